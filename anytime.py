@@ -0,0 +1,74 @@
+# Support for "best answer within T seconds" runs.
+#
+# An Incumbent keeps the best solution a solver has found, the trace of its
+# improvements and the reasons to stop early: a wall-clock deadline, a
+# target cost, SIGINT, or a stop event shared with other processes.
+
+import signal
+from contextlib import contextmanager
+from time import time
+from instrument import event
+
+class Incumbent(object):
+    def __init__(self, max_seconds=None, target=None, stop=None):
+        self.start = time()
+        self.deadline = None if max_seconds is None else self.start + max_seconds
+        self.target = target
+        self.stop = stop
+        self.interrupted = False
+        self.solution = None
+        self.key = None
+        self.trace = []  # (seconds, cost, unfitness) of every improvement
+
+    def offer(self, solution, cost, unfitness=0):
+        """Keep ``solution`` if it beats the incumbent; True if it did."""
+        key = (unfitness, cost)
+        if self.key is not None and key >= self.key:
+            return False
+        self.solution, self.key = solution, key
+        seconds = time() - self.start
+        self.trace.append((seconds, cost, unfitness))
+        event('incumbent', seconds=seconds, cost=float(cost),
+              unfitness=int(unfitness))
+        if self.stop is not None and self.target_reached():
+            self.stop.set()
+        return True
+
+    def target_reached(self):
+        return (self.target is not None and self.key is not None and
+                self.key[0] == 0 and self.key[1] <= self.target)
+
+    def done(self):
+        return (self.interrupted or self.target_reached() or
+                (self.deadline is not None and time() >= self.deadline) or
+                (self.stop is not None and self.stop.is_set()))
+
+    def remaining(self):
+        """Seconds left before the deadline, or None if there is none."""
+        if self.deadline is not None:
+            return max(self.deadline - time(), 0)
+
+    @contextmanager
+    def catch_interrupt(self):
+        """Turn SIGINT into a request to stop, while in the block."""
+        def interrupt(signum, frame):
+            self.interrupted = True
+            if self.stop is not None:
+                self.stop.set()
+        try:
+            previous = signal.signal(signal.SIGINT, interrupt)
+        except ValueError:  # not in the main thread
+            yield
+            return
+        try:
+            yield
+        finally:
+            signal.signal(signal.SIGINT, previous)
+
+    def write_trace(self, stream):
+        for seconds, cost, unfitness in self.trace:
+            stream.write('%.3f\t%s\t%d\n' % (seconds, cost, unfitness))
+
+def ignore_interrupts():
+    """For worker processes: leave SIGINT to the parent."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
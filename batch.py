@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+# Solve many instances in one run.
+#
+# Instances are dispatched to a pool of worker processes that live for the
+# whole batch, so Python, NumPy and the solver modules are loaded once per
+# worker, and rotation sets come from the cache as for single runs. Each
+# finished instance is written at once as a JSON line.
+#
+# With --timeout, solvers stop and return their best solution once an
+# instance has run that long. An instance still running --grace seconds
+# later (say, stuck enumerating rotations) is reported as timed out and its
+# worker given up on until it finishes; the pool is restarted when no worker
+# is left.
+
+import os
+import sys
+import json
+import traceback
+from glob import glob
+from time import time
+from functools import partial
+from multiprocessing import Pool, cpu_count
+from csp import CREW_COST
+range = xrange
+
+def solve_grasp(path, config, incumbent):
+    import grasp
+    from cache import load_problem
+    from relink import ElitePool
+    csp, rotations = load_problem(open(path))
+    crew_cost = config.get('crew_cost', CREW_COST)
+    greedy = grasp.GreedyKeys(rotations, config.get('ptb', 300),
+                              config.get('pertr', 0))
+    search = partial(grasp.local_search, crew_cost=crew_cost,
+                     mode=config.get('search', 'first'),
+                     max_evaluations=config.get('evaluations'))
+    reactive = None
+    if config.get('reactive'):
+        reactive = grasp.ReactiveAlpha(block_size=config.get('block_size', 50),
+                                       seed=config.get('seed', 0))
+    elite = ElitePool(config['elite']) if config.get('elite') else None
+    solution = grasp.grasp(rotations, csp, config.get('alpha', 0.3), greedy,
+                           max_iterations=config.get('iterations', 100) or None,
+                           seed=config.get('seed', 0), search=search,
+                           crew_cost=crew_cost, target=config.get('target'),
+                           incumbent=incumbent, reactive=reactive,
+                           elite=elite)
+    if solution is None:
+        return None
+    return (rotations.costs[solution].sum() + crew_cost * len(solution),
+            0, solution)
+
+def solve_ga(path, config, incumbent):
+    import ga
+    problem = ga.Problem(open(path), crew_cost=config.get('crew_cost', CREW_COST))
+    ga.random_seed(config.get('seed', 0))
+    ga.random.seed(config.get('seed', 0))
+    best = ga.ga(problem, config.get('population', 100),
+                 config.get('iterations', 1000) or None,
+                 incumbent=incumbent)
+    return (best.fitness, best.unfitness,
+            problem.column_ids[ga.selected_columns(problem, best.columns)])
+
+SOLVERS = {
+    'grasp': solve_grasp,
+    'ga': solve_ga,
+}
+
+# Config keys each solver reads; others are rejected rather than ignored.
+CONFIG_KEYS = {
+    'grasp': set(['alpha', 'block_size', 'crew_cost', 'elite', 'evaluations',
+                  'iterations', 'pertr', 'ptb', 'reactive', 'search', 'seed',
+                  'target']),
+    'ga': set(['crew_cost', 'iterations', 'population', 'seed', 'target']),
+}
+
+def init_worker():
+    import grasp
+    from anytime import ignore_interrupts
+    ignore_interrupts()
+    grasp.DEBUG_RCL = grasp.DEBUG_SOLUTION = grasp.DEBUG_MOVE = lambda *args: None
+
+def solve_instance(path, solver, config, timeout):
+    """Result record of one instance."""
+    from anytime import Incumbent
+    start = time()
+    incumbent = Incumbent(timeout, config.get('target'))
+    record = dict(instance=path, solver=solver, pid=os.getpid())
+    try:
+        result = SOLVERS[solver](path, config, incumbent)
+    except Exception:
+        record.update(status='error', error=traceback.format_exc())
+    else:
+        if result is None:
+            record.update(status='no_solution')
+        else:
+            cost, unfitness, rotations = result
+            record.update(status='ok', cost=float(cost),
+                          unfitness=int(unfitness),
+                          rotations=[int(k) for k in rotations])
+            # False if the timeout cut the search short
+            record['complete'] = not (incumbent.deadline is not None and
+                                      time() >= incumbent.deadline)
+    record['seconds'] = time() - start
+    return record
+
+def instance_paths(args, manifest=None):
+    """Instance files named by ``args`` (files or directories of *.txt
+    files) and by the lines of a ``manifest`` file."""
+    names = list(args)
+    if manifest is not None:
+        base = os.path.dirname(manifest)
+        for line in open(manifest):
+            line = line.split('#', 1)[0].strip()
+            if line:
+                names.append(os.path.join(base, line))
+    paths = []
+    for name in names:
+        if os.path.isdir(name):
+            paths.extend(sorted(glob(os.path.join(name, '*.txt'))))
+        else:
+            paths.append(name)
+    return paths
+
+def solve_batch(paths, solver, config, workers, timeout=None, grace=30,
+                stream=sys.stdout):
+    """Solve every instance of ``paths``, writing each record to ``stream``
+    as a JSON line when done, and return the records."""
+    records = []
+    def emit(record):
+        records.append(record)
+        stream.write(json.dumps(record, sort_keys=True) + '\n')
+        stream.flush()
+
+    queue = list(reversed(paths))
+    pool = Pool(workers, init_worker)
+    # At most one instance per free worker is handed to the pool, so that
+    # its timeout counts from when it starts running.
+    running = []    # (async result, path, start)
+    abandoned = []  # results of instances given up on, still keeping a worker
+    try:
+        while queue or running:
+            # A worker comes back when its abandoned instance finishes.
+            abandoned = [result for result in abandoned if not result.ready()]
+            while queue and len(running) < workers - len(abandoned):
+                path = queue.pop()
+                result = pool.apply_async(solve_instance,
+                                          (path, solver, config, timeout))
+                running.append((result, path, time()))
+            running[0][0].wait(0.1)
+            still_running = []
+            for result, path, start in running:
+                if result.ready():
+                    emit(result.get())
+                elif timeout is not None and time() - start > timeout + grace:
+                    emit(dict(instance=path, solver=solver, status='timeout',
+                              seconds=time() - start))
+                    abandoned.append(result)
+                else:
+                    still_running.append((result, path, start))
+            running = still_running
+            if len(abandoned) == workers:
+                pool.terminate()
+                pool.join()
+                pool = Pool(workers, init_worker)
+                abandoned = []
+    finally:
+        pool.terminate()
+        pool.join()
+    return records
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(usage="usage: %prog [options] [instance_or_directory...]")
+    parser.add_option('-m', '--manifest', metavar='FILE', help='File listing instance files, one per line')
+    parser.add_option('--solver', choices=sorted(SOLVERS), default='grasp', metavar='NAME', help='Solver: %s' % ', '.join(sorted(SOLVERS)))
+    parser.add_option('-c', '--config', metavar='FILE', help='JSON object of solver options, as named by the long options of grasp.py or ga.py')
+    parser.add_option('-w', '--workers', type='int', default=cpu_count(), metavar='NUM', help='Number of worker processes')
+    parser.add_option('-t', '--timeout', type='float', metavar='NUM', help='Seconds after which each instance returns its best solution')
+    parser.add_option('--grace', type='float', default=30, metavar='NUM', help='Further seconds before giving up on an instance')
+    parser.add_option('-o', '--output', metavar='FILE', help='Append the JSON lines to FILE instead of printing them')
+    (options, args) = parser.parse_args()
+
+    paths = instance_paths(args, options.manifest)
+    if not paths:
+        parser.error('no instances given')
+    config = {}
+    if options.config:
+        config = json.load(open(options.config))
+        config = dict((str(k).replace('-', '_'), v) for k, v in config.items())
+        unknown = set(config) - CONFIG_KEYS[options.solver]
+        if unknown:
+            parser.error('config options not supported by %s: %s' % (
+                options.solver, ', '.join(sorted(unknown))))
+    stream = open(options.output, 'a') if options.output else sys.stdout
+    records = solve_batch(paths, options.solver, config, options.workers,
+                          options.timeout, options.grace, stream)
+    if any(r['status'] in ('error', 'timeout') for r in records):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
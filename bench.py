@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+# Benchmarks of the solver building blocks over ORLIB instances.
+#
+# Each stage runs in a child process of its own, so that the peak resident
+# set size it reports belongs to that stage alone; stages that need the
+# rotation cache warm get it from a previous child. Results are written as
+# JSON, with the traceback of the stages that failed; ``--compare OLD NEW``
+# reports the stages that got slower or bigger, or that now fail.
+
+import os
+import sys
+import json
+import traceback
+from Queue import Empty
+from glob import glob
+from time import time
+from resource import getrusage, RUSAGE_SELF
+from multiprocessing import Process, Queue
+from csp import CREW_COST
+range = xrange
+
+FORMAT_VERSION = 1
+
+def stage_generation(path, options):
+    from csp import CrewSchedulingProblem
+    from rotationset import RotationSet
+    csp = CrewSchedulingProblem(open(path))
+    start = time()
+    rotations = RotationSet.generate(csp)
+    return time() - start, len(rotations), 'rotations/s'
+
+def warm_cache(path, options):
+    from cache import load_problem
+    load_problem(open(path))
+    return 0, None, None
+
+def stage_ga_problem(path, options):
+    import ga
+    start = time()
+    ga.Problem(open(path), crew_cost=CREW_COST)
+    return time() - start, None, None
+
+def stage_gamatrix_problem(path, options):
+    import gamatrix
+    start = time()
+    gamatrix.Problem(open(path), crew_cost=CREW_COST)
+    return time() - start, None, None
+
+def stage_grasp_construction(path, options):
+    import grasp
+    from cache import load_problem
+    grasp.DEBUG_RCL = grasp.DEBUG_SOLUTION = lambda *args: None
+    grasp.random_seed(options.seed)
+    grasp.numpy_seed(options.seed)
+    csp, rotations = load_problem(open(path))
+    rotations.matrix()
+    greedy = grasp.GreedyKeys(rotations, per_task_bonification=300)
+    start = time()
+    grasp.construct_solution(rotations, csp, greedy, 0.3)
+    return time() - start, len(rotations), 'candidates/s'
+
+def stage_ga_iterations(path, options):
+    import ga
+    problem = ga.Problem(open(path), crew_cost=CREW_COST)
+    # Same seed for both runs, so the initial populations are identical
+    # and the difference is the time spent in the iterations.
+    elapsed = []
+    for nr_iterations in (0, options.ga_iterations):
+        ga.random_seed(options.seed)
+        ga.random.seed(options.seed)
+        start = time()
+        ga.ga(problem, options.population, nr_iterations)
+        elapsed.append(time() - start)
+    return elapsed[1] - elapsed[0], options.ga_iterations, 'evaluations/s'
+
+# (name, stage, warm-up run in a separate child before the stage, or None)
+STAGES = [
+    ('generation', stage_generation, None),
+    ('ga_problem', stage_ga_problem, warm_cache),
+    ('gamatrix_problem', stage_gamatrix_problem, warm_cache),
+    ('grasp_construction', stage_grasp_construction, None),
+    ('ga_iterations', stage_ga_iterations, None),
+]
+
+def run_stage(stage, path, options, results):
+    try:
+        seconds, count, unit = stage(path, options)
+    except Exception:
+        results.put(('error', traceback.format_exc()))
+        return
+    peak_rss = getrusage(RUSAGE_SELF).ru_maxrss
+    results.put(('ok', (seconds, count, unit, peak_rss)))
+
+def stage_result(p, results):
+    """What the stage run by process ``p`` put in ``results``, or an error
+    if the process died without putting anything."""
+    while True:
+        try:
+            return results.get(timeout=1)
+        except Empty:
+            if not p.is_alive():
+                try:  # it may have put its result just before exiting
+                    return results.get(timeout=1)
+                except Empty:
+                    return 'error', 'exit code %s\n' % p.exitcode
+
+def run_child(stage, path, options):
+    results = Queue()
+    p = Process(target=run_stage, args=(stage, path, options, results))
+    p.start()
+    status, result = stage_result(p, results)
+    p.join()
+    return status, result
+
+def benchmark(paths, stages, options, stream=sys.stdout):
+    records = []
+    for path in paths:
+        for name, stage, warm_up in stages:
+            status, result = 'ok', None
+            if warm_up is not None:
+                status, result = run_child(warm_up, path, options)
+            if status == 'ok':
+                status, result = run_child(stage, path, options)
+            record = dict(instance=os.path.basename(path), stage=name)
+            if status == 'error':
+                record.update(error=result)
+                records.append(record)
+                stream.write('%-12s %-20s FAILED\n%s' % (record['instance'],
+                                                         name, result))
+                continue
+            seconds, count, unit, peak_rss = result
+            record.update(seconds=seconds, peak_rss_kb=peak_rss)
+            if count is not None:
+                record.update(rate=count / max(seconds, 1e-9), rate_unit=unit)
+            records.append(record)
+            stream.write('%-12s %-20s %9.3fs %9d KB%s\n' % (
+                    record['instance'], name, seconds, peak_rss,
+                    '  %12.1f %s' % (record['rate'], unit) if count else ''))
+    return records
+
+def compare(old, new, threshold, min_seconds=0, stream=sys.stdout):
+    """Records of ``new`` slower or bigger than in ``old`` by more than
+    ``threshold`` (relative). Times must also grow by more than
+    ``min_seconds``, so that noise on short stages is not reported."""
+    before = dict(((r['instance'], r['stage']), r) for r in old['results'])
+    regressions = []
+    for r in new['results']:
+        o = before.get((r['instance'], r['stage']))
+        if o is None or 'error' in o:
+            continue
+        if 'error' in r:
+            regressions.append((r['instance'], r['stage'], 'error'))
+            stream.write('FAILED     %-12s %-20s\n' % regressions[-1][:2])
+            continue
+        for field in ('seconds', 'peak_rss_kb'):
+            if field == 'seconds' and r[field] - o[field] <= min_seconds:
+                continue
+            if r[field] > o[field] * (1 + threshold):
+                regressions.append((r['instance'], r['stage'], field,
+                                    o[field], r[field]))
+                stream.write('REGRESSION %-12s %-20s %-12s %10.3f -> %10.3f\n'
+                             % regressions[-1])
+    return regressions
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(usage="usage: %prog [options] [input_file...]\n"
+                                "       %prog --compare OLD NEW")
+    parser.add_option('-o', '--output', default='bench_results.json', metavar='FILE', help='Results file')
+    parser.add_option('--stages', metavar='LIST', help='Comma separated stages to run (default: all)')
+    parser.add_option('-n', '--ga-iterations', type='int', default=100, metavar='NUM', help='GA iterations to time')
+    parser.add_option('-p', '--population', type='int', default=100, metavar='NUM', help='GA population size')
+    parser.add_option('-s', '--seed', type='int', default=0, metavar='NUM', help='Random seed')
+    parser.add_option('--compare', action='store_true', help='Compare two results files instead of benchmarking')
+    parser.add_option('-t', '--threshold', type='float', default=0.1, metavar='NUM', help='Relative increase reported as a regression')
+    parser.add_option('--min-seconds', type='float', default=0.05, metavar='NUM', help='Smallest time increase reported as a regression')
+    (options, args) = parser.parse_args()
+
+    if options.compare:
+        if len(args) != 2:
+            parser.error('--compare needs two results files')
+        old, new = [json.load(open(f)) for f in args]
+        if compare(old, new, options.threshold, options.min_seconds):
+            sys.exit(1)
+        return
+
+    paths = args or sorted(glob('orlib/csp*.txt'),
+                           key=lambda p: int(''.join(c for c in p if c.isdigit())))
+    stages = STAGES
+    if options.stages:
+        names = options.stages.split(',')
+        unknown = set(names) - set(name for name, stage, warm_up in STAGES)
+        if unknown:
+            parser.error('unknown stages: %s' % ', '.join(sorted(unknown)))
+        stages = [s for s in STAGES if s[0] in names]
+
+    records = benchmark(paths, stages, options)
+    results = dict(version=FORMAT_VERSION, python=sys.version.split()[0],
+                   crew_cost=CREW_COST, ga_iterations=options.ga_iterations,
+                   population=options.population, seed=options.seed,
+                   results=records)
+    with open(options.output, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    if any('error' in r for r in records):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
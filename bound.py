@@ -0,0 +1,105 @@
+# Lower bounds for the set partitioning model of crew scheduling.
+#
+# Relaxing the constraints A x = 1 with multipliers u gives
+#     L(u) = sum(u) + sum_j min(0, c_j - u A_j),
+# a lower bound on the cost of every solution, whose maximum over u is the
+# bound of the LP relaxation. It is approached by subgradient optimization
+# as in:
+#     J.E.Beasley. Lagrangean relaxation.
+#     In Modern heuristic techniques for combinatorial problems (1993).
+
+from collections import namedtuple
+from numpy import asarray, diff, minimum, zeros, inf, isinf
+from sparse import segment_sum
+range = xrange
+
+Bound = namedtuple('Bound', 'lower upper multipliers reduced_costs solution')
+
+def reduced_costs(A, costs, u):
+    return costs - segment_sum(u[A.row_ind], A.col_ptr)
+
+def greedy_partition(A, key):
+    """Columns taken by increasing ``key`` when disjoint from those taken
+    before, or None if some row is left uncovered."""
+    covered = zeros(A.shape[0], dtype=bool)
+    solution = []
+    def take(candidates):
+        for j in candidates[key[candidates].argsort(kind='mergesort')]:
+            rows = A.columns[j]
+            if not covered[rows].any():
+                covered[rows] = True
+                solution.append(j)
+    # Few columns have a negative key; the others only matter if they fit
+    # in the rows left uncovered, which is checked for all of them at once.
+    take((key < 0).nonzero()[0])
+    take(((key >= 0) & (A.hits(covered) == 0)).nonzero()[0])
+    return solution if covered.all() else None
+
+def lagrangian_bound(A, costs, upper_bound=None, multipliers=None,
+                     max_iterations=1000, step=2.0, patience=30,
+                     min_step=0.005, heuristic_interval=10):
+    """Best Lagrangian bound found for min c x subject to A x = 1.
+
+    ``step`` is halved after ``patience`` iterations without improvement,
+    and the search ends when it falls below ``min_step``. Every
+    ``heuristic_interval`` iterations the columns are taken greedily by
+    reduced cost to improve the upper bound that drives the step size;
+    the best solution found that way is returned with the bound.
+
+    The search starts from ``multipliers`` if given, from the cheapest cost
+    per row of the columns over each row otherwise.
+    """
+    costs = asarray(costs, dtype=float)
+    upper = inf if upper_bound is None else upper_bound
+    solution = None
+
+    if multipliers is None:
+        unit_costs = costs / diff(A.col_ptr)
+        u = minimum.reduceat(unit_costs[A.col_ind], A.row_ptr[:-1])
+    else:
+        u = asarray(multipliers, dtype=float)
+
+    best, best_u, best_d = -inf, u, None
+    stalled = 0
+    for t in range(max_iterations):
+        d = reduced_costs(A, costs, u)
+        value = u.sum() + d[d < 0].sum()
+        if value > best:
+            best, best_u, best_d = value, u, d
+            stalled = 0
+        else:
+            stalled += 1
+            if stalled == patience:
+                step /= 2
+                stalled = 0
+                if step < min_step:
+                    break
+
+        if t % heuristic_interval == 0:
+            s = greedy_partition(A, d)
+            if s is not None and costs[s].sum() < upper:
+                upper, solution = costs[s].sum(), s
+        if upper - best <= 1e-9 * abs(upper):
+            break  # the upper bound is optimal
+
+        subgradient = 1 - A.cover((d < 0).nonzero()[0])
+        norm = (subgradient ** 2).sum()
+        if norm == 0:
+            break  # the relaxed solution is a partition: u is optimal
+        target = 1.05 * abs(value) + 1 if isinf(upper) else upper
+        u = u + step * (target - value) / norm * subgradient
+    return Bound(best, upper, best_u, best_d, solution)
+
+def reduce_columns(bound, tolerance=1e-6):
+    """Boolean mask of the columns that may be part of a solution costing
+    no more than the upper bound of ``bound``.
+
+    Taking column j raises the Lagrangian bound by its reduced cost, so
+    columns for which that exceeds the gap can be dropped.
+    """
+    gap = bound.upper - bound.lower
+    return bound.reduced_costs <= gap + tolerance * max(abs(bound.upper), 1)
+
+def gap(cost, lower):
+    """Optimality gap of a solution of ``cost``, relative to the cost."""
+    return (cost - lower) / float(cost) if cost else 0.0
@@ -0,0 +1,74 @@
+# On-disk cache of the rotations generated for each instance.
+#
+# Each entry is a directory named after a hash of the instance file contents
+# and its time limit, holding one .npy file per RotationSet array plus a
+# header. Arrays are memory-mapped on load, so repeated runs on the same
+# instance skip both the enumeration and most of the reading.
+
+import os
+import sys
+from hashlib import sha1
+from shutil import rmtree
+from tempfile import mkdtemp
+from numpy import array, asarray, load, save
+from csp import CrewSchedulingProblem
+from rotationset import RotationSet
+from instrument import phase
+
+# Bump whenever the layout or the contents of the cached arrays change.
+FORMAT_VERSION = 3
+CACHE_DIR = os.environ.get('CSP_CACHE_DIR', '.rotation-cache')
+ARRAYS = ('offsets', 'tasks', 'costs', 'durations')
+
+def cache_path(csp, contents, cache_dir=CACHE_DIR):
+    key = sha1(contents)
+    key.update('\0%d' % csp.time_limit)
+    return os.path.join(cache_dir, key.hexdigest())
+
+def read_cache(csp, contents, cache_dir=CACHE_DIR):
+    """Cached rotations of the instance, or None if missing or stale."""
+    path = cache_path(csp, contents, cache_dir)
+    try:
+        header = load(os.path.join(path, 'header.npy'))
+        if list(header) != [FORMAT_VERSION, len(csp.tasks), csp.time_limit]:
+            return None
+        # Plain ndarray views of the maps: slicing a memmap is much slower.
+        arrays = [asarray(load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+                  for name in ARRAYS]
+    except (IOError, ValueError):
+        return None
+    return RotationSet(len(csp.tasks), *arrays)
+
+def write_cache(csp, contents, rotations, cache_dir=CACHE_DIR):
+    path = cache_path(csp, contents, cache_dir)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # Write to a scratch directory and rename it, so that concurrent
+        # runs never see a half-written entry.
+        tmp = mkdtemp(dir=cache_dir)
+        for name in ARRAYS:
+            save(os.path.join(tmp, name + '.npy'), getattr(rotations, name))
+        header = [FORMAT_VERSION, len(csp.tasks), csp.time_limit]
+        save(os.path.join(tmp, 'header.npy'), array(header, dtype='int64'))
+        if os.path.isdir(path):
+            rmtree(path, ignore_errors=True)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Another run stored the same entry meanwhile.
+            rmtree(tmp, ignore_errors=True)
+    except (IOError, OSError), e:
+        sys.stderr.write("Couldn't write rotation cache %s: %s\n" % (path, e))
+
+def load_problem(problem_file, rebuild=False, cache_dir=CACHE_DIR):
+    """Parse an instance and get its rotations, from the cache if possible."""
+    with phase('parse'):
+        contents = problem_file.read()
+        csp = CrewSchedulingProblem(contents.splitlines())
+    rotations = None if rebuild else read_cache(csp, contents, cache_dir)
+    if rotations is None:
+        with phase('enumerate'):
+            rotations = RotationSet.generate(csp)
+        write_cache(csp, contents, rotations, cache_dir)
+    return csp, rotations
@@ -0,0 +1,111 @@
+# Column generation: grow a pool of rotations by pricing, instead of
+# enumerating them all.
+#
+# The pool starts with one rotation per task. Each round computes the
+# Lagrangian multipliers of the pool (bound.py) and prices rotations with
+# them: the reduced cost of a rotation is the crew cost plus its transition
+# costs minus the multipliers of its tasks. Tasks are sorted by start time
+# and transitions go forward in time, so for a given first task the time
+# limit only restricts which tasks may follow, and the cheapest rotations
+# are shortest paths in a DAG.
+
+from csp import CrewSchedulingProblem, Rotation, frozenset
+from rotationset import RotationSet
+from bound import lagrangian_bound
+from instrument import phase, event
+range = xrange
+
+def check_order(csp):
+    """Raise ValueError unless the tasks of ``csp`` are ordered as pricing
+    assumes (see CrewSchedulingProblem.order_violation)."""
+    violation = csp.order_violation()
+    if violation is not None:
+        raise ValueError(violation)
+
+def price(csp, duals, crew_cost, per_start=1, known=lambda tasks: False,
+          tolerance=1e-6):
+    """Rotations of negative reduced cost, at most ``per_start`` of them
+    for each first task, skipping those whose sorted tasks are ``known``.
+
+    Ending at each task, the one of least reduced cost is considered. The
+    tasks must be ordered as check_order() requires.
+    """
+    tasks = csp.tasks
+    successors = csp.successors()
+    duals = list(duals)
+    for s, first in enumerate(tasks):
+        latest = first.start + csp.time_limit
+        if first.finish > latest:
+            continue
+        reduced = {s: crew_cost - duals[s]}
+        paid = {s: 0}  # transition costs along the same paths
+        previous = {}
+        for v in range(s, len(tasks)):
+            if tasks[v].start > latest:
+                break  # neither v nor any later task fits
+            r = reduced.get(v)
+            if r is None:
+                continue
+            for w, cost in successors[v]:
+                if tasks[w].finish <= latest:
+                    rw = r + cost - duals[w]
+                    if rw < reduced.get(w, rw + 1):
+                        reduced[w] = rw
+                        paid[w] = paid[v] + cost
+                        previous[w] = v
+
+        found = 0
+        for v in sorted(reduced, key=reduced.get):
+            if found == per_start or reduced[v] >= -tolerance:
+                break
+            path = [v]
+            while path[-1] != s:
+                path.append(previous[path[-1]])
+            path.reverse()
+            if known(path):
+                continue
+            found += 1
+            yield Rotation(frozenset(path), paid[v],
+                           tasks[v].finish - first.start)
+
+def generate_columns(csp, crew_cost, max_rounds=50, per_start=2,
+                     bound_iterations=300):
+    """Pool of rotations grown until pricing finds no new rotation of
+    negative reduced cost, or for ``max_rounds``.
+
+    Returns the pool as a RotationSet, the Lagrangian bound on it and
+    whether pricing ran out of new rotations. The bound is one of the pool:
+    pricing only looks at the cheapest rotation between each pair of first
+    and last tasks, so it is not a proven bound for the full problem.
+    """
+    check_order(csp)
+    nr_tasks = len(csp.tasks)
+    pool = [Rotation(frozenset([i]), 0, t.finish - t.start)
+            for i, t in enumerate(csp.tasks)
+            if t.finish - t.start <= csp.time_limit]
+    multipliers = None
+    for round in range(max_rounds):
+        rotations = RotationSet.from_rotations(pool, nr_tasks)
+        with phase('bound'):
+            bound = lagrangian_bound(rotations.matrix(),
+                                     rotations.costs + crew_cost,
+                                     multipliers=multipliers,
+                                     max_iterations=bound_iterations)
+        multipliers = bound.multipliers
+        known = lambda tasks: rotations.find(tasks) is not None
+        with phase('pricing'):
+            new = list(price(csp, multipliers, crew_cost, per_start, known))
+        event('pricing', round=round, pool=len(rotations), new=len(new),
+              lower=float(bound.lower), upper=float(bound.upper))
+        if not new:
+            return rotations, bound, True
+        pool.extend(new)
+    return RotationSet.from_rotations(pool, nr_tasks), bound, False
+
+def load_pool(problem_file, crew_cost, **options):
+    """Parse an instance and generate its rotation pool, as load_problem()
+    does for the full set of rotations."""
+    with phase('parse'):
+        csp = CrewSchedulingProblem(problem_file.read().splitlines())
+    rotations, bound, converged = generate_columns(csp, crew_cost, **options)
+    return csp, rotations
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 
-from collections import defaultdict
 from itertools import izip as zip
+from numpy import fromstring, zeros, empty, cumsum, bincount, unique, minimum, \
+                  diff, arange, array
+from sparse import Slices
 range = xrange
 try:
     from collections import namedtuple
@@ -11,84 +13,210 @@ except ImportError:
 Task = namedtuple('Task', ['start', 'finish'])
 Rotation = namedtuple('Rotation', ['tasks', 'cost', 'duration'])
 
+# Default cost of each rotation in a solution, besides its transitions, for
+# every solver: without it, solutions fall apart into single task rotations.
+CREW_COST = 1000
+
 # hack for nice set printing
 class frozenset(frozenset):
     __repr__ = lambda self: '{%s}' % str.join(', ', map(str, sorted(self)))
 
+class TransitionCosts(object):
+    """Read-only mapping from ``(i, j)`` to the cost of the transition from
+    task i to task j, over the compressed transition graph."""
+    def __init__(self, ptr, successors, costs):
+        self.ptr, self.successors, self.costs = ptr, successors, costs
+
+    def __len__(self):
+        return len(self.successors)
+
+    def __getitem__(self, (i, j)):
+        """The cost, or infinity if there is no such transition."""
+        lo, hi = self.ptr[i], self.ptr[i + 1]
+        e = (self.successors[lo:hi] == j).nonzero()[0]
+        return self.costs[lo + e[-1]] if len(e) else float('inf')
+
+    def __contains__(self, (i, j)):
+        return self[i, j] != float('inf')
+
+
 class CrewSchedulingProblem:
     """Crew Scheduling problem instance from ORLIB."""
     def __init__(self, input_file):
-        file_contents = [tuple(map(int, line.split())) for line in input_file]
-        nr_tasks, time_limit = file_contents.pop(0)
-
-        self.time_limit = time_limit
-        self.tasks = [Task(*t) for t in file_contents[:nr_tasks]]
-        self.transition_costs = defaultdict(lambda: float('inf'))
-        self.possible_transitions = [list() for task in self.tasks]
-        for i, j, cost in file_contents[nr_tasks:]:
-            # Reindex to start from 0, not from 1 as in ORLIB instances
-            self.transition_costs[i - 1, j - 1] = cost
-            self.possible_transitions[i - 1].append(j - 1)
+        values = fromstring(' '.join(input_file), dtype='int64', sep=' ')
+        nr_tasks, time_limit = values[:2]
+        times = values[2:2 + 2 * nr_tasks].reshape(nr_tasks, 2)
+        arcs = values[2 + 2 * nr_tasks:].reshape(-1, 3)
+        # Reindex to start from 0, not from 1 as in ORLIB instances
+        i, j, cost = arcs[:, 0] - 1, arcs[:, 1] - 1, arcs[:, 2]
+
+        # A repeated transition keeps its last cost. Otherwise the
+        # successors of each task stay in file order.
+        _, last = unique((i * nr_tasks + j)[::-1], return_index=True)
+        keep = len(i) - 1 - last
+        keep.sort()  # unique() orders them by key, i.e. by j
+        keep = keep[i[keep].argsort(kind='mergesort')]
+
+        self.time_limit = int(time_limit)
+        self.tasks = [Task(*t) for t in times.tolist()]
+        # CSR transition graph: the successors of task i are
+        # transition_to[transition_ptr[i]:transition_ptr[i + 1]]
+        self.transition_ptr = zeros(nr_tasks + 1, dtype='int64')
+        cumsum(bincount(i[keep], minlength=nr_tasks), out=self.transition_ptr[1:])
+        self.transition_to = j[keep]
+        self.transition_cost = cost[keep]
+        self.transition_costs = TransitionCosts(
+                self.transition_ptr, self.transition_to, self.transition_cost)
+        self.possible_transitions = Slices(self.transition_ptr,
+                                           self.transition_to)
+
+        # Earliest finish time among the successors of each task, used to
+        # stop extending a rotation that cannot grow within the time limit.
+        next_finish = empty(nr_tasks)
+        next_finish.fill(float('inf'))
+        minimum.at(next_finish, i, times[j, 1].astype(float))
+        self.earliest_next_finish = next_finish.tolist()
+
+    def order_violation(self):
+        """Why the tasks are not sorted by start time with every transition
+        going to a later task that starts after the first one ends, or None
+        if they are."""
+        start = array([t.start for t in self.tasks])
+        finish = array([t.finish for t in self.tasks])
+        if (diff(start) < 0).any():
+            return 'tasks are not sorted by start time'
+        i = arange(len(self.tasks)).repeat(diff(self.transition_ptr))
+        j = self.transition_to
+        backward = ((j <= i) | (start[j] < finish[i])).nonzero()[0]
+        if len(backward):
+            k = backward[0]
+            return 'transition %d -> %d does not go forward in time' % (
+                    i[k] + 1, j[k] + 1)
+        return None
+
+    def successors(self):
+        """Per task, the list of ``(successor, transition cost)`` pairs."""
+        ptr = self.transition_ptr.tolist()
+        pairs = list(zip(self.transition_to.tolist(),
+                         self.transition_cost.tolist()))
+        return [pairs[ptr[k]:ptr[k + 1]] for k in range(len(self.tasks))]
 
     def generate_rotations(self, from_rotation=()):
-        if from_rotation:
-            candidates = self.possible_transitions[from_rotation[-1]]
+        starts = [t.start for t in self.tasks]
+        finishes = [t.finish for t in self.tasks]
+        successors = self.successors()
+        next_finish = self.earliest_next_finish
+
+        # Explicit DFS: ``path`` is the rotation being built and every frame
+        # in ``stack`` holds the (task, transition cost) candidates still to
+        # try after ``path[:k]`` together with the cost of ``path[:k]``.
+        path = list(from_rotation)
+        if path:
+            cost = sum(self.transition_costs[t] for t in zip(path, path[1:]))
+            stack = [(iter(successors[path[-1]]), cost)]
         else:
-            candidates = range(len(self.tasks))
+            stack = [(((task, 0) for task in range(len(starts))), 0)]
 
-        for task in candidates:
-            rotation = from_rotation + (task,)
-            start_time  = self.tasks[rotation[0]].start
-            finish_time = self.tasks[rotation[-1]].finish
-            duration = finish_time - start_time
-            if duration > self.time_limit:
-                continue
-            cost = sum(self.transition_costs[t] for t in zip(rotation, rotation[1:]))
-            yield Rotation(frozenset(rotation), cost, duration)
+        while stack:
+            candidates, cost = stack[-1]
+            for task, transition_cost in candidates:
+                start_time = starts[path[0]] if path else starts[task]
+                duration = finishes[task] - start_time
+                if duration > self.time_limit:
+                    continue
+                task_cost = cost + transition_cost
+                path.append(task)
+                yield Rotation(frozenset(path), task_cost, duration)
+
+                # Descend only if some successor can still finish in time.
+                if next_finish[task] - start_time <= self.time_limit:
+                    stack.append((iter(successors[task]), task_cost))
+                    break
+                path.pop()
+            else:
+                stack.pop()
+                if stack:
+                    path.pop()
 
-            for r in self.generate_rotations(rotation):
-                yield r
 
 
 
 def main():
     import sys
+    from optparse import OptionParser
+    import instrument
+
+    parser = OptionParser(usage="usage: %prog [options] [input_file]")
+    parser.add_option('--rebuild-cache', action='store_true', help='Regenerate the cached rotations of the instance')
+    instrument.add_options(parser)
+    (options, args) = parser.parse_args()
 
-    if len(sys.argv) < 2 or sys.argv[1] == '-':
+    if not args or args[0] == '-':
         problem_file = sys.stdin
     else:
         try:
-            problem_file = open(sys.argv[1])
+            problem_file = open(args[0])
         except IOError:
-            sys.stderr.write("Couldn't open file %s\n" % problem_file)
+            sys.stderr.write("Couldn't open file %s\n" % args[0])
             sys.exit(-1)
+    instrument.setup(options)
+    instrument.run(options, show, options, args, problem_file)
 
-    csp = CrewSchedulingProblem(problem_file)
+def show(options, args, problem_file):
+    import sys
+    from time import time
+    from cache import read_cache, write_cache
+    from rotationset import RotationSet
+    from instrument import phase
+
+    with phase('parse'):
+        contents = problem_file.read()
+        csp = CrewSchedulingProblem(contents.splitlines())
 
     if problem_file == sys.stdin:
         print '--- Problem from stdin ---'
     else:
-        print '--- Problem: %s ---' % (sys.argv[1])
+        print '--- Problem: %s ---' % (args[0])
     
     print 'Problem size: %d' % len(csp.tasks)
     print 'Time limit: %d  ' % csp.time_limit
     print 'Transitions: %d ' % len(csp.transition_costs)
     print
 
+    rotations = None if options.rebuild_cache else read_cache(csp, contents)
+    if rotations is None:
+        start = time()
+        with phase('enumerate'):
+            rotations = RotationSet.generate(csp)
+        elapsed = time() - start
+        write_cache(csp, contents, rotations)
+    else:
+        elapsed = None
+
     try:
         from ptable import Table
     except ImportError:
         pass
     else:
-        t = Table(csp.generate_rotations())
+        t = Table(rotations)
         t.headers = ('Rotation', 'Cost', 'Duration')
         t.align = 'lrr'
         t.col_separator = ' | '
         t.repeat_headers_after = 25
         t.header_separator = True
         t.print_table()
-    print '# of rotations: %d' % (len(t.data))
+    print '# of rotations: %d' % len(rotations)
+    if elapsed is None:
+        print 'Rotations loaded from cache'
+    else:
+        generated = len(rotations) + (rotations.nr_duplicates or 0)
+        print 'Rotations per second: %.0f' % (generated / max(elapsed, 1e-9))
+        if rotations.nr_duplicates is None:
+            print 'Duplicate task sets: none possible, transitions go forward'
+        else:
+            print 'Duplicate task sets dropped: %d (%.1f%%)' % (
+                    rotations.nr_duplicates,
+                    100.0 * rotations.nr_duplicates / max(generated, 1))
 
 if __name__ == '__main__':
     main()
-
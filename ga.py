@@ -5,67 +5,106 @@
 #     Constraint Handling in Genetic Algorithms: The Set Partitioning Problem.
 #     Journal of Heuristics, 11: 323--357 (1998)
 
-from csp import CrewSchedulingProblem, namedtuple
-from random import choice, randrange
-from numpy import dot, zeros, array, matrix, random, sum, abs, transpose
+from csp import namedtuple, CREW_COST
+from cache import load_problem
+from colgen import load_pool
+from random import choice, randrange, seed as random_seed, \
+                   getstate as random_getstate, setstate as random_setstate
+from multiprocessing import Process, Queue, Event
+from Queue import Empty
+from instrument import phase, count, event
+from anytime import Incumbent, ignore_interrupts
+from bound import lagrangian_bound, reduce_columns, gap
+import instrument
+from numpy import zeros, array, arange, random, sum, abs, unpackbits, \
+                  load, savez_compressed
+from tempfile import mkstemp
+from zlib import crc32
+import os
 from operator import attrgetter
-from itertools import izip as zip
+from itertools import izip as zip, count as counter
 range = xrange
 
 class Problem:
     # fields: A, c
-    def __init__(self, problem_file):
-        csp = CrewSchedulingProblem(problem_file)
-        columns, costs = [], []
-        for rotation in csp.generate_rotations():
-            column = zeros(len(csp.tasks), dtype='uint8')
-            for task in rotation.tasks:
-                column[task] = 1
-            columns.append(column)
-            costs.append(rotation.cost)
-
-        A = array(columns).transpose()
-        m, n = A.shape
+    def __init__(self, problem_file, rebuild_cache=False, crew_cost=CREW_COST,
+                 column_generation=False):
+        if column_generation:
+            csp, rotations = load_pool(problem_file, crew_cost)
+        else:
+            csp, rotations = load_problem(problem_file, rebuild_cache)
+        self.crew_cost = crew_cost
+        # original index of each column, kept through restrict()
+        self.column_ids = arange(len(rotations))
+        self.set_rotations(rotations)
 
-        alpha = [set() for row in range(m)]
-        beta =  [set() for col in range(n)]
-        for row, col in transpose(A.nonzero()):
-            alpha[row].add(col)
-            beta [col].add(row)
+    def set_rotations(self, rotations):
+        A = rotations.matrix()
+        m, n = A.shape
 
+        self.rotations = rotations
         self.A = A
-        self.costs = array(costs)
+        self.costs = rotations.costs + self.crew_cost
+        self.unit_costs = self.costs / rotations.sizes.astype(float)
         self.nr_tasks, self.nr_rotations = m, n
-        self.alpha = map(frozenset, alpha)
-        self.beta  = map(frozenset, beta)
+        self.alpha = A.rows     # columns covering each row
+        self.beta  = A.columns  # rows covered by each column
+
+    def restrict(self, keep):
+        """Drop the columns not in ``keep`` (indices or a boolean mask)."""
+        self.column_ids = self.column_ids[keep]
+        self.set_rotations(self.rotations.select(keep))
 
     def __repr__(self):
         return '<CSP problem, %dx%d>' % (self.nr_tasks, self.nr_rotations)
 
 
 
+# Solutions keep their columns bit-packed as numpy.packbits does: column j
+# is bit 7 - j % 8 of byte j // 8.
 Solution = namedtuple('Solution', 'columns covering fitness unfitness')
 
-def make_solution(problem, columns):
-    covering = dot(problem.A, columns)
-    fitness = dot(problem.costs, columns)
+POPCOUNT = array([bin(b).count('1') for b in range(256)], dtype='uint8')
+
+def no_columns(problem):
+    return zeros((problem.nr_rotations + 7) // 8, dtype='uint8')
+
+def column_bits(columns, js):
+    return (columns[js >> 3] >> (7 - (js & 7))) & 1
+
+def set_column(columns, j):
+    columns[j >> 3] |= 0x80 >> (j & 7)
+
+def clear_column(columns, j):
+    columns[j >> 3] &= 0xff ^ (0x80 >> (j & 7))
+
+def selected_columns(problem, columns):
+    return unpackbits(columns)[:problem.nr_rotations].nonzero()[0]
+
+def make_solution(problem, columns, covering=None):
+    js = selected_columns(problem, columns)
+    if covering is None:
+        covering = problem.A.cover(js)
+    fitness = problem.costs[js].sum()
     unfitness = sum(abs(covering - 1))
     return Solution(columns, covering, fitness, unfitness)
 
 def initial_solution(problem):
-    columns = zeros(problem.nr_rotations, dtype='uint8')
-    I = frozenset(range(problem.nr_tasks))
-    S, U = set(), set(I)
+    columns = no_columns(problem)
+    U = set(range(problem.nr_tasks))
+    closed = zeros(problem.nr_tasks, dtype=bool)  # rows not in U
     while U:
         i = choice(list(U))
-        J = [j for j in problem.alpha[i] if not (problem.beta[j] & (I - U))]
-        if J:
+        J = problem.alpha[i]
+        J = J[problem.A.hits(closed, J) == 0]
+        if len(J):
             j = choice(J)
-            columns[j] = 1
-            U -= problem.beta[j]
+            set_column(columns, j)
+            U.difference_update(problem.beta[j])
+            closed[problem.beta[j]] = True
         else:
             U.remove(i)
-    #columns = random.randint(2, size=problem.nr_rotations).astype('uint8')
+            closed[i] = True
     return make_solution(problem, columns)
 
 def binary_tournament(population):
@@ -73,39 +112,81 @@ def binary_tournament(population):
     candidates = [randrange(population_size) for _ in range(2)]
     return min(candidates, key=lambda index: population[index].fitness)
 
-def matching_selection(problem, population):
-    '''Indices of the solutions selected for crossover.'''
+def matching_selection(problem, population, bits):
+    '''Indices of the solutions selected for crossover.
+
+    ``bits`` holds the packed columns of every solution, one per row.
+    '''
     P1 = binary_tournament(population)
     if population[P1].unfitness == 0:
         P2 = binary_tournament(population)
     else:
-        cols_P1 = population[P1].columns
-        def compatibility(k):
-            cols_Pk = population[k].columns
-            comp = sum(cols_P1 | cols_Pk) - sum(cols_P1 & cols_Pk)
-            return comp, population[P1].fitness  # use fitness to break ties
-        P2 = max((k for k, sol in enumerate(population) if k != P1),
-                 key=compatibility)
+        # |P1 xor Pk| for the whole population in one pass
+        compatibility = POPCOUNT[bits ^ bits[P1]].sum(1, dtype='int64')
+        compatibility[P1] = -1
+        P2 = compatibility.argmax()
     return (P1, P2)
 
 def uniform_crossover(parent1, parent2):
     '''Columns of the child after crossover.'''
-    mask = random.randint(2, size=parent1.columns.size)
-    return mask * parent1.columns + (1 - mask) * parent2.columns
+    mask = random.randint(256, size=parent1.columns.size).astype('uint8')
+    return (parent1.columns & mask) | (parent2.columns & ~mask)
+
+def add_column(problem, columns, covering, j):
+    set_column(columns, j)
+    covering[problem.beta[j]] += 1
+
+def drop_column(problem, columns, covering, j):
+    clear_column(columns, j)
+    covering[problem.beta[j]] -= 1
 
-def static_mutation(columns, M_s=3):
+def static_mutation(problem, columns, covering, M_s=3):
     for _ in range(M_s):
-        j = randrange(columns.size)
-        columns[j] = 1 - columns[j]
+        j = randrange(problem.nr_rotations)
+        if column_bits(columns, j):
+            drop_column(problem, columns, covering, j)
+        else:
+            add_column(problem, columns, covering, j)
     return columns
 
-def adaptive_mutation(columns, M_a=5, epsilon=0.5):
+def adaptive_mutation(problem, columns, covering, row_coverage,
+                      population_size, M_a=5, epsilon=0.5):
+    """Add M_a random columns over every row that fewer than epsilon times
+    the population size solutions cover (``row_coverage``)."""
+    for i in (row_coverage < epsilon * population_size).nonzero()[0]:
+        J = problem.alpha[i]
+        if len(J):
+            for _ in range(M_a):
+                j = choice(J)
+                if not column_bits(columns, j):
+                    add_column(problem, columns, covering, j)
     return columns
 
+def repair(problem, columns, covering):
+    """Chu-Beasley heuristic improvement operator.
+
+    DROP removes random columns from over-covered rows, visited in random
+    order, and ADD then covers each uncovered row with the column of least
+    cost per row among those covering uncovered rows only.
+    """
+    for i in random.permutation(problem.nr_tasks):
+        if covering[i] > 1:
+            S = problem.alpha[i]
+            S = S[column_bits(columns, S) == 1]
+            for j in random.permutation(S):
+                if covering[i] <= 1:
+                    break
+                drop_column(problem, columns, covering, j)
 
-def repair(solution):
-    # ...
-    return solution
+    for i in (covering == 0).nonzero()[0]:
+        if covering[i]:
+            continue
+        J = problem.alpha[i]
+        J = J[problem.A.hits(covering > 0, J) == 0]
+        if len(J):
+            j = J[problem.unit_costs[J].argmin()]
+            add_column(problem, columns, covering, j)
+    return columns
     
 def ranking_replacement(population, child):
     # Labels for solutions according to relation with child.
@@ -128,7 +209,7 @@ def ranking_replacement(population, child):
         key=sort_key)
 
     population[worst_k] = child
-    return worst_k
+    return worst_k, worst_sol
 
 
 
@@ -139,36 +220,287 @@ def best_solution(population):
     return best_k
     
 
-def ga(problem, population_size=100, nr_iterations=1000):
-    population = [initial_solution(problem) for k in range(population_size)]
-    best_k = best_solution(population)
-    for t in range(nr_iterations):
-        p1, p2 = matching_selection(problem, population)
-        child = uniform_crossover(population[p1], population[p2])
-        child = static_mutation(child)
-        child = adaptive_mutation(child)
-        child = repair(child)
-        child = make_solution(problem, child)
-        child_k = ranking_replacement(population, child)
-        if best_solution([population[best_k], child]) == 1:
-            best_k = child_k
-            print "Found better child!"
+def insert_solution(population, bits, row_coverage, child):
+    """Replace a member of the population by ``child``, keeping the packed
+    columns and the row coverage of the population up to date."""
+    child_k, replaced = ranking_replacement(population, child)
+    bits[child_k] = child.columns
+    row_coverage += (child.covering > 0)
+    row_coverage -= (replaced.covering > 0)
+    return child_k
+
+def best_solutions(population, n):
+    return sorted(population, key=lambda sol: (sol.unfitness, sol.fitness))[:n]
+
+# Checkpoints are .npz files holding the packed columns of the population,
+# the best index, the next iteration and the states of both random number
+# generators. Coverings and fitnesses are computed again from the columns.
+CHECKPOINT_VERSION = 1
+
+def checkpoint_key(problem, population_size):
+    """What a checkpoint must have been written for to be resumed."""
+    return array([problem.nr_tasks, problem.nr_rotations, population_size,
+                  crc32(problem.costs.tostring()) & 0xffffffff], dtype='int64')
+
+def save_checkpoint(path, problem, population, best_k, iteration):
+    """Write the state of a GA run to ``path``, atomically."""
+    version, internal, gauss_next = random_getstate()
+    name, keys, pos, has_gauss, cached_gaussian = random.get_state()
+    fd, tmp = mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                      suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            savez_compressed(f,
+                version=CHECKPOINT_VERSION,
+                key=checkpoint_key(problem, len(population)),
+                columns=array([sol.columns for sol in population]),
+                best_k=best_k, iteration=iteration,
+                random_version=version,
+                random_internal=array(internal, dtype='int64'),
+                random_gauss=[] if gauss_next is None else [gauss_next],
+                numpy_keys=keys, numpy_pos=pos, numpy_has_gauss=has_gauss,
+                numpy_gauss=cached_gaussian)
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+def load_checkpoint(path, problem, population_size):
+    """Population, best index and next iteration saved in ``path``; the
+    random number generators are left as they were when it was written."""
+    state = load(path)
+    if (state['version'] != CHECKPOINT_VERSION or
+            list(state['key']) != list(checkpoint_key(problem, population_size))):
+        raise ValueError("checkpoint %s doesn't match this problem and "
+                         "population size" % path)
+    population = [make_solution(problem, columns.copy())
+                  for columns in state['columns']]
+    gauss = state['random_gauss']
+    random_setstate((int(state['random_version']),
+                     tuple(int(x) for x in state['random_internal']),
+                     float(gauss[0]) if len(gauss) else None))
+    random.set_state(('MT19937', state['numpy_keys'], int(state['numpy_pos']),
+                      int(state['numpy_has_gauss']),
+                      float(state['numpy_gauss'])))
+    return population, int(state['best_k']), int(state['iteration'])
+
+def ga(problem, population_size=100, nr_iterations=1000,
+       M_s=3, M_a=5, epsilon=0.5, migrate=None, migration_interval=None,
+       max_seconds=None, target=None, incumbent=None,
+       checkpoint=None, checkpoint_interval=100, resume=False):
+    """Best solution found by the Chu-Beasley GA.
+
+    If ``migrate`` is given, every ``migration_interval`` iterations it is
+    called with the population and returns solutions to insert into it.
+
+    Stops after ``nr_iterations`` (unbounded if None), once ``max_seconds``
+    have elapsed, once a feasible solution costs at most ``target`` or on
+    SIGINT, whichever comes first. The limits may also be given by an
+    anytime.Incumbent, which then records the improvements of the run.
+
+    If ``checkpoint`` is given, the state of the run is saved there every
+    ``checkpoint_interval`` iterations and when it stops. With ``resume``
+    the run starts from that state instead, counting ``nr_iterations``
+    from the start of the first run, and goes on exactly as if it had
+    never stopped.
+    """
+    if incumbent is None:
+        incumbent = Incumbent(max_seconds, target)
+    if resume:
+        population, best_k, start = load_checkpoint(checkpoint, problem,
+                                                    population_size)
+    else:
+        population = [initial_solution(problem) for k in range(population_size)]
+        best_k = best_solution(population)
+        start = 0
+    # number of solutions in the population covering each row
+    row_coverage = sum([sol.covering > 0 for sol in population], axis=0)
+    bits = array([sol.columns for sol in population])
+    incumbent.offer(population[best_k], population[best_k].fitness,
+                    population[best_k].unfitness)
+    iterations = counter(start) if nr_iterations is None else range(start, nr_iterations)
+    next_iteration = start
+    with incumbent.catch_interrupt():
+        for t in iterations:
+            if incumbent.done():
+                break
+            with phase('select'):
+                p1, p2 = matching_selection(problem, population, bits)
+            with phase('crossover'):
+                columns = uniform_crossover(population[p1], population[p2])
+                covering = problem.A.cover(selected_columns(problem, columns))
+            with phase('mutate'):
+                static_mutation(problem, columns, covering, M_s)
+                adaptive_mutation(problem, columns, covering, row_coverage,
+                                  population_size, M_a, epsilon)
+            with phase('repair'):
+                repair(problem, columns, covering)
+
+            arrivals = [make_solution(problem, columns, covering)]
+            if migrate is not None and (t + 1) % migration_interval == 0:
+                with phase('migrate'):
+                    arrivals.extend(migrate(population))
+            with phase('replace'):
+                for child in arrivals:
+                    child_k = insert_solution(population, bits, row_coverage, child)
+                    if best_solution([population[best_k], child]) == 1:
+                        best_k = child_k
+                        event('improved', iteration=t, fitness=int(child.fitness),
+                              unfitness=int(child.unfitness))
+                        incumbent.offer(child, child.fitness, child.unfitness)
+            count('children')
+            next_iteration = t + 1
+            if checkpoint is not None and next_iteration % checkpoint_interval == 0:
+                with phase('checkpoint'):
+                    save_checkpoint(checkpoint, problem, population, best_k,
+                                    next_iteration)
+    if checkpoint is not None:
+        save_checkpoint(checkpoint, problem, population, best_k, next_iteration)
     return population[best_k]
 
-    
-   
+
+def island(problem, index, seed, inbox, outbox, results, migration_size,
+           stop, max_seconds=None, target=None, **ga_options):
+    """Run ga() in a process of its own, sending its best solutions to the
+    next island and receiving those of the previous one at each migration.
+
+    All islands stop once ``stop`` is set, by the parent or by the island
+    reaching the target.
+    """
+    ignore_interrupts()
+    instrument.reset()
+    random_seed(seed + index)
+    random.seed(seed + index)
+    # Stopped neighbours may leave our last migrants unread: don't wait for
+    # them to be flushed when exiting.
+    outbox.cancel_join_thread()
+    incumbent = Incumbent(max_seconds, target, stop)
+    def migrate(population):
+        outbox.put(best_solutions(population, migration_size))
+        while True:
+            try:
+                return inbox.get(timeout=0.1)
+            except Empty:
+                if incumbent.done():
+                    return []
+    best = ga(problem, migrate=migrate, incumbent=incumbent, **ga_options)
+    results.put((index, best, instrument.collect()))
+
+def island_ga(problem, nr_islands=4, migration_interval=100, migration_size=2,
+              seed=0, max_seconds=None, target=None, incumbent=None,
+              **ga_options):
+    """Best solution of ``nr_islands`` GA populations evolving in parallel
+    and exchanging solutions around a ring.
+
+    The limits are as for ga(); the incumbent of the parent only sees the
+    final solution of each island.
+    """
+    if incumbent is None:
+        incumbent = Incumbent(max_seconds, target)
+    stop = Event()
+    inboxes = [Queue() for i in range(nr_islands)]
+    results = Queue()
+    processes = [Process(target=island,
+                         args=(problem, i, seed, inboxes[i],
+                               inboxes[(i + 1) % nr_islands], results,
+                               migration_size, stop, incumbent.remaining(),
+                               incumbent.target),
+                         kwargs=dict(ga_options,
+                                     migration_interval=migration_interval))
+                 for i in range(nr_islands)]
+    for p in processes:
+        p.start()
+    bests = []
+    with incumbent.catch_interrupt():
+        while len(bests) < nr_islands:
+            try:
+                bests.append(results.get(timeout=0.1))
+            except Empty:
+                if incumbent.done():
+                    stop.set()
+    for p in processes:
+        p.join()
+    for index, sol, totals in sorted(bests):
+        instrument.merge(totals)
+        incumbent.offer(sol, sol.fitness, sol.unfitness)
+    return incumbent.solution
 
     
 def main():
     from optparse import OptionParser
     parser = OptionParser(usage="usage: %prog [options] [input_file]")
+    parser.add_option('-n', '--iterations', type='int', default=1000, metavar='NUM', help='Number of children bred by each population, 0 for no limit')
+    parser.add_option('-t', '--seconds', type='float', metavar='NUM', help='Stop after this many seconds')
+    parser.add_option('--target', type='float', metavar='NUM', help='Stop once a feasible solution costs at most this much')
+    parser.add_option('--convergence', metavar='FILE', help='Write the time, cost and unfitness of each improvement to FILE')
+    parser.add_option('-p', '--population', type='int', default=100, metavar='NUM', help='Population size')
+    parser.add_option('-s', '--seed', type='int', default=0, metavar='NUM', help='Random seed')
+    parser.add_option('-i', '--islands', type='int', default=1, metavar='NUM', help='Number of populations evolving in parallel processes')
+    parser.add_option('--migration-interval', type='int', default=100, metavar='NUM', help='Iterations between migrations among islands')
+    parser.add_option('--migration-size', type='int', default=2, metavar='NUM', help='Number of solutions each island sends per migration')
+    parser.add_option('-c', '--crew-cost', type='float', default=CREW_COST, metavar='NUM', help='Cost of each rotation in a solution, besides its transitions')
+    parser.add_option('--column-generation', action='store_true', help='Search a pool of rotations grown by pricing instead of all of them')
+    parser.add_option('--bound', action='store_true', help='Compute a Lagrangian lower bound and report the optimality gap')
+    parser.add_option('--reduce', action='store_true', help='Also drop the columns whose reduced cost exceeds the gap')
+    parser.add_option('--checkpoint', metavar='FILE', help='Save the state of the run to FILE (.npz) periodically and at the end')
+    parser.add_option('--checkpoint-interval', type='int', default=100, metavar='NUM', help='Iterations between checkpoints')
+    parser.add_option('--resume', action='store_true', help='Continue the run saved in the checkpoint file; -n counts from its start')
+    parser.add_option('--rebuild-cache', action='store_true', help='Regenerate the cached rotations of the instance')
+    instrument.add_options(parser)
     (options, args) = parser.parse_args()
     if not args:
         parser.print_usage()
         return
+    if options.checkpoint and options.islands > 1:
+        parser.error('checkpoints are only supported with a single population')
+    if options.resume and not options.checkpoint:
+        parser.error('--resume needs --checkpoint')
+    if options.profile and options.islands > 1:
+        parser.error('--profile only covers this process: use it with -i 1')
+    instrument.setup(options)
+    instrument.run(options, solve, options, args)
 
-    problem = Problem(open(args[0]))
-    print ga(problem)
+def solve(options, args):
+    problem = Problem(open(args[0]), options.rebuild_cache, options.crew_cost,
+                      options.column_generation)
+    if options.column_generation:
+        print 'Rotation pool: %d' % problem.nr_rotations
+    bound = None
+    if options.bound or options.reduce:
+        with phase('bound'):
+            bound = lagrangian_bound(problem.A, problem.costs)
+        print '%s: %.1f, upper bound: %d' % (
+                'Pool lower bound' if options.column_generation else 'Lower bound',
+                bound.lower, bound.upper)
+        if options.reduce:
+            keep = reduce_columns(bound)
+            print 'Columns kept: %d of %d' % (keep.sum(), len(keep))
+            problem.restrict(keep)
+    incumbent = Incumbent(options.seconds, options.target)
+    if options.islands > 1:
+        best = island_ga(problem, options.islands, options.migration_interval,
+                         options.migration_size, options.seed,
+                         incumbent=incumbent,
+                         population_size=options.population,
+                         nr_iterations=options.iterations or None)
+    else:
+        random_seed(options.seed)
+        random.seed(options.seed)
+        best = ga(problem, options.population, options.iterations or None,
+                  incumbent=incumbent, checkpoint=options.checkpoint,
+                  checkpoint_interval=options.checkpoint_interval,
+                  resume=options.resume)
+    if options.convergence:
+        with open(options.convergence, 'w') as f:
+            incumbent.write_trace(f)
+    print 'fitness: %d, unfitness: %d, columns: %s' % (
+            best.fitness, best.unfitness,
+            ' '.join(map(str, problem.column_ids[selected_columns(problem, best.columns)])))
+    if bound is not None and best.unfitness == 0:
+        # On a generated pool the bound only holds for the pool.
+        print '%s gap: %.2f%%' % (
+                'Pool optimality' if options.column_generation else 'Optimality',
+                100 * gap(best.fitness, bound.lower))
 
 if __name__ == '__main__':
     main()
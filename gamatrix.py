@@ -5,38 +5,34 @@
 #     Constraint Handling in Genetic Algorithms: The Set Partitioning Problem.
 #     Journal of Heuristics, 11: 323--357 (1998)
 
-from csp import CrewSchedulingProblem, namedtuple, frozenset
-from random import choice
+from csp import namedtuple, CREW_COST
+from cache import load_problem
+from sparse import segment_sum, gather, gather_ranges
+from instrument import phase, count
+import instrument
+from random import choice, seed
 from operator import attrgetter
 from numpy import *
 range = xrange
 
 class Problem:
-    # fields: A, c, alpha, beta
-    def __init__(self, problem_file):
-        csp = CrewSchedulingProblem(problem_file)
-        columns, costs = [], []
-        for rotation in csp.generate_rotations():
-            column = zeros(len(csp.tasks), dtype='uint8')
-            for task in rotation.tasks:
-                column[task] = 1
-            columns.append(column)
-            costs.append(rotation.cost)
-
-        A = array(columns).transpose()
+    # fields: A, costs, alpha, beta
+    def __init__(self, problem_file, rebuild_cache=False, crew_cost=CREW_COST):
+        csp, rotations = load_problem(problem_file, rebuild_cache)
+        A = rotations.matrix()
         m, n = A.shape
-        
-        alpha = [set() for row in range(m)]
-        beta =  [set() for col in range(n)]
-        for row, col in transpose(A.nonzero()):
-            alpha[row].add(col)
-            beta [col].add(row)
 
         self.A = A
-        self.rotation_costs = array(costs)
+        self.crew_cost = crew_cost
+        self.costs = rotations.costs + crew_cost
         self.nr_rows, self.nr_cols = m, n
-        self.alpha = map(frozenset, alpha)
-        self.beta  = map(frozenset, beta)
+        self.alpha = A.rows
+        self.beta  = A.columns
+        # the columns over each row by increasing cost per row, for ADD:
+        # those of row i are cheapest[A.row_ptr[i]:A.row_ptr[i + 1]]
+        ratio = self.costs / diff(A.col_ptr).astype(float)
+        self.cheapest = A.col_ind[lexsort((ratio[A.col_ind],
+                                           arange(m).repeat(diff(A.row_ptr))))]
 
     def __repr__(self):
         return '<CSP problem, %dx%d>' % (self.nr_rows, self.nr_cols)
@@ -44,43 +40,297 @@ class Problem:
 
 def initial_solution(problem, population_size=1):
     solution = zeros((problem.nr_cols, population_size), dtype='uint8')
-    I = frozenset(range(problem.nr_rows))
     for k in range(population_size):
-        S, U = set(), set(I)
+        U = set(range(problem.nr_rows))
+        closed = zeros(problem.nr_rows, dtype=bool)  # rows not in U
         while U:
             i = choice(list(U))
-            J = [j for j in problem.alpha[i] if not (problem.beta[j] & (I - U))]
-            if J:
+            J = problem.alpha[i]
+            J = J[problem.A.hits(closed, J) == 0]
+            if len(J):
                 j = choice(J)
                 solution[j, k] = 1
-                U -= problem.beta[j]
+                U.difference_update(problem.beta[j])
+                closed[problem.beta[j]] = True
             else:
                 U.remove(i)
+                closed[i] = True
     return solution
 
 
-def ga(problem, nr_iterations=100, population_size=100):
-    population = [initial_solution(problem, population_size)
-                  for k in range(population_size)]
-    best = best_solution(population)
+# Every field holds one column (or entry) per solution.
+Population = namedtuple('Population', 'columns covering fitness unfitness')
+
+def evaluate(problem, columns, covering=None):
+    """Population made of the solutions in the columns of ``columns``."""
+    if covering is None:
+        covering = problem.A.cover_all(columns)
+    js, ks = columns.nonzero()
+    fitness = bincount(ks, weights=problem.costs[js],
+                       minlength=columns.shape[1]).astype('int64')
+    unfitness = abs(covering - 1).sum(0)
+    return Population(columns, covering, fitness, unfitness)
+
+def binary_tournament(population, size):
+    candidates = random.randint(len(population.fitness), size=(2, size))
+    better = population.fitness[candidates[1]] < population.fitness[candidates[0]]
+    return candidates[better.astype(int), arange(size)]
+
+def matching_selection(population, batch_size):
+    """Indices of the parents of each child of the batch.
+
+    The second parent of a child whose first parent is infeasible is the
+    most compatible member of the population, i.e. the one whose columns
+    differ the most from it.
+    """
+    P1 = binary_tournament(population, batch_size)
+    P2 = binary_tournament(population, batch_size)
+    infeasible = (population.unfitness[P1] > 0).nonzero()[0]
+    if len(infeasible):
+        columns = population.columns
+        # nonzeros of the transpose come grouped by parent, as segment_sum needs
+        ks, js = columns[:, P1[infeasible]].T.nonzero()
+        offsets = concatenate(([0], cumsum(bincount(ks, minlength=len(infeasible)))))
+        common = segment_sum(columns[js], offsets)
+        sizes = columns.sum(0, dtype='int64')
+        # |P1 xor Pk| = |P1| + |Pk| - 2 |P1 and Pk|
+        compatibility = sizes[P1[infeasible], newaxis] + sizes - 2 * common
+        compatibility[arange(len(infeasible)), P1[infeasible]] = -1
+        P2[infeasible] = compatibility.argmax(1)
+    return P1, P2
+
+def uniform_crossover(population, P1, P2):
+    """Columns of the children, one per pair of parents."""
+    C = population.columns[:, P1]
+    other = population.columns[:, P2]
+    # only the columns where the parents differ need a coin flip
+    js, ks = (C != other).nonzero()
+    flip = random.randint(2, size=len(js)).astype(bool)
+    C[js[flip], ks[flip]] = other[js[flip], ks[flip]]
+    return C
+
+def mutation(problem, population, C, M_s=3, M_a=5, epsilon=0.5):
+    """Static mutation of M_s random columns of every child, and adaptive
+    mutation adding M_a random columns over each row covered by fewer than
+    epsilon times the population size."""
+    nr_children = C.shape[1]
+    children = arange(nr_children)
+    for _ in range(M_s):
+        js = random.randint(problem.nr_cols, size=nr_children)
+        C[js, children] ^= 1
+
+    coverage = (population.covering > 0).sum(1)
+    for i in (coverage < epsilon * len(population.fitness)).nonzero()[0]:
+        J = problem.alpha[i]
+        if len(J):
+            js = J[random.randint(len(J), size=(M_a, nr_children))]
+            C[js, children] = 1
+    return C
+
+def repair(problem, C):
+    """Chu-Beasley DROP/ADD heuristic applied to every child at once.
+
+    Both steps work in rounds over all the (row, child) pairs that need
+    it. Returns the children's covering, kept up to date while columns
+    are dropped and added.
+    """
+    A = problem.A
+    m, nr_children = problem.nr_rows, C.shape[1]
+    js, ks = C.nonzero()
+    covering = A.cover_pairs(js, ks, nr_children)
+
+    # DROP: visit the over-covered rows of each child in an order of its
+    # own, keeping one of the row's columns at random. A row whose columns
+    # cover no over-covered row coming before it in that order is dealt
+    # with in the current round, as it would be when visited in turn.
+    visit = random.random_sample(covering.shape).argsort(0)  # row -> turn
+    while len(js):
+        over = covering > 1
+        if not over.any():
+            break
+        rows, offsets = gather(A.col_ptr, A.row_ind, js)
+        sizes = diff(offsets)
+        ks_ = ks.repeat(sizes)
+        rank = where(over[rows, ks_], visit[rows, ks_], m)
+        first = minimum.reduceat(rank, offsets[:-1])
+        # the first over-covered row of each column, if any
+        hit = (rank == first.repeat(sizes)) & (rank < m)
+        owner, which = rows[hit], arange(len(js)).repeat(sizes)[hit]
+        named = bincount(owner * nr_children + ks[which],
+                         minlength=covering.size).reshape(covering.shape)
+        ready = named[owner, ks[which]] == covering[owner, ks[which]]
+        owner, which = owner[ready], which[ready]
+        # keep the first column of each ready row in a random order
+        group = owner * nr_children + ks[which]
+        shuffled = lexsort((random.random_sample(len(group)), group))
+        group = group[shuffled]
+        drop = which[shuffled][r_[False, group[1:] == group[:-1]]]
+        C[js[drop], ks[drop]] = 0
+        covering -= A.cover_pairs(js[drop], ks[drop], nr_children)
+        kept = ones(len(js), dtype=bool)
+        kept[drop] = False
+        js, ks = js[kept], ks[kept]
+
+    # ADD: cover every uncovered row with the column of best cost ratio
+    # among those whose rows are all uncovered. Each round, every row still
+    # uncovered looks along its problem.cheapest columns for the first one
+    # that is free, from where it left off (a column blocked once stays
+    # blocked), up to ``reach`` columns further, doubled for the rows that
+    # find none. The columns found are added unless they share a row with
+    # the column found by an earlier row of the same child.
+    row_sizes = diff(A.row_ptr)
+    scanned = zeros(covering.shape, dtype='int64')
+    reach = zeros(covering.shape, dtype='int64') + 4
+    while True:
+        rs, ks = ((covering == 0) & (scanned < row_sizes[:, newaxis])).nonzero()
+        if not len(rs):
+            break
+        starts = A.row_ptr[rs] + scanned[rs, ks]
+        stops = minimum(starts + reach[rs, ks], A.row_ptr[rs + 1])
+        candidates, offsets = gather_ranges(problem.cheapest, starts, stops)
+        sizes = diff(offsets)
+        rows, col_offsets = gather(A.col_ptr, A.row_ind, candidates)
+        entries = rows * nr_children + ks.repeat(sizes).repeat(diff(col_offsets))
+        free = segment_sum(covering.ravel()[entries] == 0, col_offsets) == \
+               diff(col_offsets)
+        position = where(free, arange(len(candidates)), offsets[-1])
+        first = minimum.reduceat(position, offsets[:-1])
+        found = first < offsets[-1]
+        scanned[rs, ks] += where(found, first - offsets[:-1], sizes)
+        reach[rs, ks] = where(found, 4, 2 * reach[rs, ks])
+        if not found.any():
+            continue
+        rs, ks, js = rs[found], ks[found], candidates[first[found]]
+
+        # the earliest row finding a column over each of their rows
+        rows, offsets = gather(A.col_ptr, A.row_ind, js)
+        sizes = diff(offsets)
+        entries = rows * nr_children + ks.repeat(sizes)
+        by = rs.repeat(sizes)
+        order = lexsort((by, entries))
+        start = r_[True, entries[order][1:] != entries[order][:-1]]
+        earliest = empty(len(by), dtype='int64')
+        earliest[order] = by[order][maximum.accumulate(
+                where(start, arange(len(order)), 0))]
+        added = segment_sum(earliest == by, offsets) == sizes
+        C[js[added], ks[added]] = 1
+        covering += A.cover_pairs(js[added], ks[added], nr_children)
+    return covering
+
+def ranking_replacement(population, children):
+    """Replace members of the population by the children, one at a time.
+
+    Children equal to a member of the population are discarded. Returns the
+    indices of the replaced members.
+    """
+    replaced = []
+    for c in range(len(children.fitness)):
+        child = children.columns[:, c]
+        same = ((population.fitness == children.fitness[c]) &
+                (population.unfitness == children.unfitness[c])).nonzero()[0]
+        if (population.columns[:, same] == child[:, newaxis]).all(0).any():
+            continue
+        # groups: (better fitness than child?, better unfitness than child?)
+        group = (1 + (population.fitness < children.fitness[c]) +
+                 2 * (population.unfitness < children.unfitness[c]))
+        k = lexsort((-population.fitness, -population.unfitness, group))[0]
+        population.columns[:, k] = child
+        population.covering[:, k] = children.covering[:, c]
+        population.fitness[k] = children.fitness[c]
+        population.unfitness[k] = children.unfitness[c]
+        replaced.append(k)
+    return replaced
+
+def best_solution(population):
+    return lexsort((population.fitness, population.unfitness))[0]
+
+def ga(problem, nr_iterations=100, population_size=100, batch_size=10,
+       M_s=3, M_a=5, epsilon=0.5):
+    """Best solution found after ``nr_iterations`` generations, each of
+    which breeds, repairs and inserts ``batch_size`` children."""
+    population = evaluate(problem, initial_solution(problem, population_size))
     for t in range(nr_iterations):
-        P1, P2 = matching_selection(population)
-        C = uniform_crossover(P1, P2)
-        C = mutation(C, M_s, M_a, epsilon)
-        C = repair(C)
-        ranking_replacement(population, C)
-        best = best_solution([best_solution, C])
-    return best
+        with phase('select'):
+            P1, P2 = matching_selection(population, batch_size)
+        with phase('crossover'):
+            C = uniform_crossover(population, P1, P2)
+        with phase('mutate'):
+            C = mutation(problem, population, C, M_s, M_a, epsilon)
+        with phase('repair'):
+            covering = repair(problem, C)
+        with phase('replace'):
+            children = evaluate(problem, C, covering)
+            ranking_replacement(population, children)
+        count('children', batch_size)
+    best = best_solution(population)
+    return Population(*(field[..., best] for field in population))
+
+
+def compare(problem_file, nr_children=1000, population_size=100, batch_size=10,
+            crew_cost=CREW_COST):
+    """Children per second bred by ga.ga and by the batched ga, both with
+    ``crew_cost`` per rotation."""
+    import ga as serial
+    from time import time
+
+    def rate(run, nr_iterations, children_per_iteration):
+        start = time()
+        run(0)
+        setup = time() - start
+        start = time()
+        run(nr_iterations)
+        elapsed = time() - start - setup
+        return nr_iterations * children_per_iteration / max(elapsed, 1e-9)
 
+    problem_file.seek(0)
+    problem = serial.Problem(problem_file, crew_cost=crew_cost)
+    serial_rate = rate(lambda n: serial.ga(problem, population_size, n),
+                       nr_children, 1)
+
+    problem_file.seek(0)
+    problem = Problem(problem_file, crew_cost=crew_cost)
+    batched_rate = rate(lambda n: ga(problem, n, population_size, batch_size),
+                        nr_children // batch_size, batch_size)
+    return serial_rate, batched_rate
 
     
 def main():
     from optparse import OptionParser
     parser = OptionParser(usage="usage: %prog [options] [input_file]")
+    parser.add_option('-n', '--iterations', type='int', default=100, metavar='NUM', help='Number of generations')
+    parser.add_option('-p', '--population', type='int', default=100, metavar='NUM', help='Population size')
+    parser.add_option('-b', '--batch', type='int', default=10, metavar='NUM', help='Children bred per generation')
+    parser.add_option('-s', '--seed', type='int', metavar='NUM', help='Random seed')
+    parser.add_option('-c', '--crew-cost', type='float', default=CREW_COST, metavar='NUM', help='Cost of each rotation in a solution, besides its transitions')
+    parser.add_option('--compare', type='int', metavar='NUM', help='Time breeding NUM children with ga.py and with this module')
+    parser.add_option('--rebuild-cache', action='store_true', help='Regenerate the cached rotations of the instance')
+    instrument.add_options(parser)
     (options, args) = parser.parse_args()
-    problem = Problem(open(args[0]))
+    if not args:
+        parser.print_usage()
+        return
+    instrument.setup(options)
+    instrument.run(options, solve, options, args)
 
-if __name__ == '__main__':
-    main()
+def solve(options, args):
+    if options.seed is not None:
+        seed(options.seed)
+        random.seed(options.seed)
 
+    problem_file = open(args[0])
+    problem = Problem(problem_file, options.rebuild_cache, options.crew_cost)
+    if options.compare:
+        serial_rate, batched_rate = compare(problem_file, options.compare,
+                                            options.population, options.batch,
+                                            options.crew_cost)
+        print 'ga.py:       %8.1f children/s' % serial_rate
+        print 'gamatrix.py: %8.1f children/s (x%.1f)' % (
+                batched_rate, batched_rate / serial_rate)
+        return
 
+    best = ga(problem, options.iterations, options.population, options.batch)
+    print 'fitness: %d, unfitness: %d, nr_rotations: %d' % (
+            best.fitness, best.unfitness, best.columns.sum())
+
+if __name__ == '__main__':
+    main()
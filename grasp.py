@@ -1,105 +1,573 @@
 #!/usr/bin/env python
 
-from csp import CrewSchedulingProblem, namedtuple
-from random import choice, random
+from cache import load_problem
+from csp import CREW_COST
+from colgen import load_pool
+from random import Random, randrange, seed as random_seed
+from sparse import gather, segment_sum
+from instrument import phase, event
+from anytime import Incumbent, ignore_interrupts
+from bound import lagrangian_bound, reduce_columns, gap
+from relink import ElitePool, path_relinking
+import instrument
+from numpy import empty, where, setdiff1d
+from numpy.random import random, seed as numpy_seed
+from itertools import izip as zip
+from multiprocessing import Pool
+from collections import deque
+from itertools import count, islice
 from functools import partial
-from operator import attrgetter
 from sys import stdout
 range = xrange
 
-Candidate = namedtuple('Candidate', 'rotation, greedy_cost')
-
-def DEBUG_RCL(candidates, rcl, selected_candidate, stream=stdout):
-    min_cost = candidates[0].greedy_cost
-    max_cost = candidates[-1].greedy_cost
-    def c_repr(c):
-        r = c.rotation
-        s = '%s:%d:%d' % (str(r.tasks), r.cost, c.greedy_cost)
-        bold = 1 if c == selected_candidate else 0
-        color = 31 if c.greedy_cost == max_cost else None
-        if c in rcl:
-            color = 32 if c.greedy_cost == min_cost else 36
+def DEBUG_RCL(rotations, sorted_costs, candidates, rcl_size, selected, stream=stdout):
+    greedy_costs = dict(zip(candidates.order, sorted_costs))
+    candidates = candidates.rotations()
+    min_cost = greedy_costs[candidates[0]]
+    max_cost = greedy_costs[candidates[-1]]
+    rcl = set(candidates[:rcl_size])
+    def c_repr(k):
+        r = rotations[k]
+        s = '%s:%d:%d' % (str(r.tasks), r.cost, greedy_costs[k])
+        bold = 1 if k == selected else 0
+        color = 31 if greedy_costs[k] == max_cost else None
+        if k in rcl:
+            color = 32 if greedy_costs[k] == min_cost else 36
         if color:
             return '\033[%d;49;%dm%s\033[0m' % (bold, color, s)
         return s
     data = (len(candidates), len(rcl), min_cost, max_cost)
     stream.write('#candidate rotations: %d, #rcl: %d, cost range: [%d, %d]\n' % data)
-    stream.write(' '.join(c_repr(c) for c in candidates))
+    stream.write(' '.join(c_repr(k) for k in candidates))
     stream.write('\n')
 
-def DEBUG_SOLUTION(rotations, stream=stdout):
-    cost = sum(r.cost for r in rotations)
-    nr_rotations = len(rotations)
+def DEBUG_SOLUTION(rotations, solution, stream=stdout):
+    cost = rotations.costs[solution].sum()
+    nr_rotations = len(solution)
     stream.write('SOLUTION FOUND cost:%d, nr_rotations: %d\n' %
             (cost, nr_rotations))
-    stream.write(' '.join(str(r.tasks) for r in rotations))
+    stream.write(' '.join(str(rotations[k].tasks) for k in solution))
     stream.write('\n')
     
 
 
-def rotation_cost(r, per_task_bonification=0, perturbation_radius=0):
-    """Cost of adding a rotation to a solution"""
-    return (-per_task_bonification * len(r.tasks) +
-             perturbation_radius * random() +
-             r.cost)
+def rotation_cost(rotations, per_task_bonification=0, perturbation_radius=0):
+    """Cost of adding each rotation of the set to a solution"""
+    return (-per_task_bonification * rotations.sizes +
+             perturbation_radius * random(len(rotations)) +
+             rotations.costs)
 
-def construct_solution(rotations, csp, greedy_cost, alpha):
-    candidates = sorted((Candidate(r, greedy_cost(r)) for r in rotations),
-                        key=attrgetter('greedy_cost'))
+class GreedyKeys(object):
+    """Greedy costs of the rotations, sorted once for all constructions.
+
+    Only the random perturbation changes between constructions: draw()
+    adds it to the sorted deterministic costs and re-sorts them, a full
+    O(n log n) sort, so only the deterministic part is saved.
+    """
+    def __init__(self, rotations, per_task_bonification=0, perturbation_radius=0):
+        costs = rotation_cost(rotations, per_task_bonification)
+        self.order = costs.argsort(kind='mergesort')
+        self.sorted_costs = costs[self.order]
+        self.perturbation_radius = perturbation_radius
+
+    def draw(self):
+        """Rotations in greedy order and their greedy costs, perturbed."""
+        if not self.perturbation_radius:
+            return self.order, self.sorted_costs
+        costs = (self.sorted_costs +
+                 self.perturbation_radius * random(len(self.order)))
+        resort = costs.argsort(kind='mergesort')
+        return self.order[resort], costs[resort]
+
+class CandidateList(object):
+    """Rotations sorted by greedy cost, from which conflicting ones are removed.
+
+    A Fenwick tree over the sorted positions counts the candidates still
+    alive, so removing one and picking the n-th alive one are O(log n).
+    """
+    def __init__(self, order):
+        self.order = order
+        self.position = order.argsort().tolist()
+        self.alive = bytearray('\1') * len(order)
+        self.tree = [i & -i for i in range(len(order) + 1)]
+        self.size = len(order)
+        self.first, self.last = 0, len(order) - 1
+
+    def __len__(self):
+        return self.size
+
+    def remove(self, k):
+        p = self.position[k]
+        if not self.alive[p]:
+            return
+        self.alive[p] = 0
+        self.size -= 1
+        tree, n, i = self.tree, len(self.tree), p + 1
+        while i < n:
+            tree[i] -= 1
+            i += i & -i
+
+    def count_before(self, p):
+        """Number of candidates alive at sorted positions below ``p``."""
+        tree, i, count = self.tree, p, 0
+        while i > 0:
+            count += tree[i]
+            i -= i & -i
+        return count
+
+    def nth(self, n):
+        """Sorted position of the ``n``-th (from 0) candidate alive."""
+        tree, p = self.tree, 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            if p + step < len(tree) and tree[p + step] <= n:
+                p += step
+                n -= tree[p]
+            step >>= 1
+        return p
+
+    def bounds(self):
+        """Sorted positions of the first and last candidates alive."""
+        while not self.alive[self.first]:
+            self.first += 1
+        while not self.alive[self.last]:
+            self.last -= 1
+        return self.first, self.last
+
+    def rotations(self):
+        return [k for p, k in enumerate(self.order) if self.alive[p]]
+
+
+def construct_solution(rotations, csp, greedy, alpha):
+    """Indices of the rotations of a greedy randomized solution, with the
+    greedy order drawn from ``greedy`` (GreedyKeys)."""
+    order, sorted_costs = greedy.draw()
+    candidates = CandidateList(order)
+    covering = rotations.matrix().rows
+    nr_covered = 0
     solution = []
-    while sum(len(r.tasks) for r in solution) < len(csp.tasks):
+    while nr_covered < len(csp.tasks):
         if not candidates:
             return None
 
-        min_cost = candidates[0].greedy_cost
-        max_cost = candidates[-1].greedy_cost
+        first, last = candidates.bounds()
+        min_cost = sorted_costs[first]
+        max_cost = sorted_costs[last]
         threshold = min_cost + alpha * (max_cost - min_cost)
-        rcl = [c for c in candidates if c.greedy_cost <= threshold]
-        selected_candidate = choice(rcl)
-        solution.append(selected_candidate.rotation)
+        rcl_end = sorted_costs.searchsorted(threshold, side='right')
+        rcl_size = candidates.count_before(rcl_end)
+        selected = order[candidates.nth(randrange(rcl_size))]
+        solution.append(selected)
 
-        DEBUG_RCL(candidates, rcl, selected_candidate)
+        DEBUG_RCL(rotations, sorted_costs, candidates, rcl_size, selected)
 
-        # reevaluate candidates
-        candidates = [c for c in candidates
-                      if not (c.rotation.tasks & selected_candidate.rotation.tasks)]
-    DEBUG_SOLUTION(solution)
+        # drop the candidates sharing a task with the selected rotation
+        tasks = rotations.tasks_of(selected)
+        for task in tasks:
+            for k in covering[task].tolist():
+                candidates.remove(k)
+        nr_covered += len(tasks)
+    DEBUG_SOLUTION(rotations, solution)
     return solution
 
-def local_search(solution):
+def DEBUG_MOVE(rotations, removed, added, delta, stream=stdout):
+    stream.write('MOVE %+d: %s -> %s\n' % (delta,
+            ' '.join(str(rotations[k].tasks) for k in removed),
+            ' '.join(str(rotations[k].tasks) for k in added)))
+
+
+def neighbourhood(rotations, weights, solution, owner, p):
+    """Moves replacing the rotation at position ``p`` of the solution.
+
+    Every move is a ``(delta, removed_positions, added_rotations)`` tuple
+    whose rotations cover the same tasks before and after, so that the
+    solution stays a partition:
+
+    * merge: the rotation and another one for one covering both (2-for-1),
+    * split: the rotation for two covering its tasks (1-for-2).
+
+    There is no 1-for-1 move: a rotation set holds a single rotation over
+    each set of tasks (see RotationSet.generate).
+    """
+    r = solution[p]
+    tasks = rotations.tasks_of(r)
+    moves = []
+
+    # Rotations through the first task of r, classified by the positions of
+    # the solution rotations that cover their tasks now.
+    candidates = rotations.matrix().rows[tasks[0]]
+    sizes = rotations.sizes[candidates]
+    covered, offsets = gather(rotations.offsets, rotations.tasks, candidates)
+    owners = owner[covered]
+    first = owners[offsets[:-1]]
+    others = segment_sum(owners != p, offsets)
+    last = owners[offsets[1:] - 1]
+
+    # split: all tasks belong to r, then its complement must be a rotation
+    for k in candidates[(others == 0) & (sizes < len(tasks))]:
+        k2 = rotations.find(setdiff1d(tasks, rotations.tasks_of(k)))
+        if k2 is not None:
+            moves.append((weights[k] + weights[k2] - weights[r], (p,), (k, k2)))
+
+    # merge: the tasks not in r all belong to a single other rotation q,
+    # and together they are all of q's tasks
+    q = where(first == p, last, first)
+    from_q = segment_sum(owners == q.repeat(sizes), offsets)
+    mixed = ((others > 0) & (sizes - others == len(tasks)) &
+             (q != p) & (from_q == others))
+    for k, q in zip(candidates[mixed], q[mixed]):
+        q2 = solution[q]
+        if rotations.sizes[q2] == rotations.sizes[k] - len(tasks):
+            moves.append((weights[k] - weights[r] - weights[q2], (p, q), (k,)))
+    return moves
+
+def local_search(rotations, solution, crew_cost=CREW_COST, mode='first', max_evaluations=None):
+    """Improve a solution with merge and split moves.
+
+    Solutions cost the sum of their rotation costs plus ``crew_cost`` per
+    rotation. In 'first' mode the first improving move found is applied, in
+    'best' mode the whole neighbourhood is scanned for the best one. The
+    search ends at a local optimum or after ``max_evaluations`` moves.
+    """
+    weights = rotations.costs + crew_cost
+    solution = list(solution)
+    owner = empty(rotations.nr_tasks, dtype='int64')
+    for p, r in enumerate(solution):
+        owner[rotations.tasks_of(r)] = p
+
+    evaluations = 0
+    nr_moves = 0
+    while max_evaluations is None or evaluations < max_evaluations:
+        best_move = None
+        for p in range(len(solution)):
+            moves = neighbourhood(rotations, weights, solution, owner, p)
+            evaluations += len(moves)
+            for move in moves:
+                if move[0] < (best_move[0] if best_move else 0):
+                    best_move = move
+                    if mode == 'first':
+                        break
+            if best_move and mode == 'first':
+                break
+            if max_evaluations is not None and evaluations >= max_evaluations:
+                break
+        if best_move is None:
+            break
+
+        delta, removed, added = best_move
+        DEBUG_MOVE(rotations, [solution[p] for p in removed], added, delta)
+        nr_moves += 1
+        for p in sorted(removed, reverse=True):
+            last = solution.pop()
+            if p < len(solution):
+                solution[p] = last
+                owner[rotations.tasks_of(last)] = p
+        for r in added:
+            owner[rotations.tasks_of(r)] = len(solution)
+            solution.append(r)
+    instrument.count('search_evaluations', evaluations)
+    instrument.count('search_moves', nr_moves)
     return solution
 
-def grasp(rotations, csp, alpha, greedy_cost, max_iterations=1):
-    best_solution = None
-    for i in range(max_iterations):
-        solution = construct_solution(rotations, csp, greedy_cost, alpha)
-        solution = local_search(solution)
-        best_solution = solution
-        break
-    return best_solution
+# Per-process state of the GRASP iterations, set up once by init_worker so
+# that the rotations are not pickled again with every iteration.
+_worker = {}
+
+def init_worker(rotations, csp, alpha, greedy, search, crew_cost, seed):
+    _worker.update(rotations=rotations, csp=csp, alpha=alpha,
+                   greedy=greedy, search=search,
+                   crew_cost=crew_cost, seed=seed)
+
+def run_iteration(iteration, alpha=None):
+    """Construction and local search seeded by the iteration number alone,
+    with the worker's alpha unless another one is given."""
+    w = _worker
+    if alpha is None:
+        alpha = w['alpha']
+    iteration_seed = (w['seed'] * 1000003 + iteration) & 0xffffffff
+    random_seed(iteration_seed)
+    numpy_seed(iteration_seed)
+    with phase('construct'):
+        solution = construct_solution(w['rotations'], w['csp'],
+                                      w['greedy'], alpha)
+    if solution is None:
+        instrument.count('failed_constructions')
+        return iteration, None, None
+    with phase('local_search'):
+        solution = w['search'](w['rotations'], solution)
+    cost = w['rotations'].costs[solution].sum() + w['crew_cost'] * len(solution)
+    return iteration, cost, [int(k) for k in solution]
+
+def init_pool_worker(*init_args):
+    ignore_interrupts()
+    instrument.reset()
+    init_worker(*init_args)
+
+def run_pooled_iteration(*args):
+    """run_iteration in a pool worker, with the timings it took."""
+    return run_iteration(*args), instrument.collect()
+
+def run_iterations(iterations, workers, init_args, stop=lambda: False):
+    """Results of run_iteration, in order, computed by ``workers`` processes.
+
+    ``iterations`` yields the argument tuples of run_iteration. Each one is
+    taken once the result from 2 * workers iterations before was returned.
+    Stops early, dropping the iterations in flight, once ``stop()`` is true.
+    """
+    if workers == 1:
+        init_worker(*init_args)
+        for args in iterations:
+            if stop():
+                return
+            yield run_iteration(*args)
+        return
+
+    pool = Pool(workers, init_pool_worker, init_args)
+    try:
+        # Keep a bounded number of iterations in flight, so that an open
+        # ended run does not queue up tasks without limit.
+        pending = deque(pool.apply_async(run_pooled_iteration, args)
+                        for args in islice(iterations, 2 * workers))
+        while pending:
+            result = pending.popleft()
+            # wait in short steps: a plain get() can't be interrupted
+            while not result.ready():
+                if stop():
+                    return
+                result.wait(0.1)
+            for args in islice(iterations, 1):
+                pending.append(pool.apply_async(run_pooled_iteration, args))
+            result, totals = result.get()
+            instrument.merge(totals)
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+class ReactiveAlpha(object):
+    """Alpha values picked with probabilities learnt from the costs of the
+    solutions they lead to, as in reactive GRASP:
+        M.Prais, C.C.Ribeiro.
+        Reactive GRASP: An application to a matrix decomposition problem
+        in TDMA traffic assignment.
+        INFORMS Journal on Computing, 12: 164--176 (2000)
+
+    The probabilities are recomputed at the end of each block of
+    iterations and used from the block after the next one on. So the
+    iterations of a block are picked from results that are all known by
+    then, if blocks hold at least as many iterations as run_iterations
+    keeps in flight, and runs don't depend on the number of workers.
+    """
+    def __init__(self, alphas=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9),
+                 block_size=50, delta=10, seed=0):
+        self.alphas = alphas
+        self.block_size = block_size
+        self.delta = delta
+        self.random = Random(seed)
+        self.totals = [0.0] * len(alphas)
+        self.counts = [0] * len(alphas)
+        self.best_cost = None
+        uniform = [1.0 / len(alphas)] * len(alphas)
+        self.probabilities = {0: uniform, 1: uniform}  # by block
+        self.picked = {}  # alpha index of the iterations in flight
+
+    def pick(self, iteration):
+        probabilities = self.probabilities[iteration // self.block_size]
+        x = self.random.random()
+        for i, p in enumerate(probabilities):
+            x -= p
+            if x < 0:
+                break
+        self.picked[iteration] = i
+        return self.alphas[i]
+
+    def record(self, iteration, cost):
+        """Learn from the result of ``iteration``; call in iteration order."""
+        i = self.picked.pop(iteration)
+        if cost is not None:
+            self.totals[i] += cost
+            self.counts[i] += 1
+            if self.best_cost is None or cost < self.best_cost:
+                self.best_cost = cost
+        if (iteration + 1) % self.block_size == 0:
+            block = iteration // self.block_size
+            self.probabilities[block + 2] = self.current_probabilities()
+
+    def current_probabilities(self):
+        # alphas not tried yet count as leading to the best solutions
+        q = [(self.best_cost * n / total) ** self.delta if n else 1.0
+             for total, n in zip(self.totals, self.counts)]
+        return [x / sum(q) for x in q]
+
+def grasp(rotations, csp, alpha, greedy, max_iterations=1,
+          max_seconds=None, workers=1, seed=0, search=None,
+          crew_cost=CREW_COST, target=None, incumbent=None, reactive=None,
+          elite=None):
+    """Cheapest solution over several GRASP iterations.
+
+    ``greedy`` holds the GreedyKeys of the rotations, ``search`` improves
+    each constructed solution (local_search with ``crew_cost`` by default),
+    and solutions cost the sum of their rotation costs plus ``crew_cost``
+    per rotation. If ``reactive`` (ReactiveAlpha)
+    is given, it picks the alpha of each iteration instead of ``alpha``.
+    If ``elite`` (relink.ElitePool) is given, each solution is relinked
+    with one of its members, the best solution on the path goes through
+    ``search`` too, and both solutions may enter the pool. Relinking runs
+    in this process, in iteration order.
+
+    Stops after ``max_iterations`` (unbounded if None), once ``max_seconds``
+    have elapsed, once a solution costs at most ``target`` or on SIGINT,
+    whichever comes first, and returns the best solution found so far. The
+    limits may also be given by an anytime.Incumbent, which then records
+    the improvements of the run.
+    """
+    if incumbent is None:
+        incumbent = Incumbent(max_seconds, target)
+    iterations = count() if max_iterations is None else iter(range(max_iterations))
+    if reactive is None:
+        iterations = ((i,) for i in iterations)
+    else:
+        if workers > 1 and reactive.block_size < 2 * workers:
+            raise ValueError('reactive blocks need at least %d iterations '
+                             'with %d workers' % (2 * workers, workers))
+        iterations = ((i, reactive.pick(i)) for i in iterations)
+    if search is None:
+        search = partial(local_search, crew_cost=crew_cost)
+    init_args = (rotations, csp, alpha, greedy, search, crew_cost, seed)
+    weights = rotations.costs + crew_cost
+    guides = Random(seed)
+    with incumbent.catch_interrupt():
+        for iteration, cost, solution in run_iterations(iterations, workers,
+                                                        init_args, incumbent.done):
+            if reactive is not None:
+                reactive.record(iteration, cost)
+            if solution is None:
+                continue
+            if incumbent.offer(solution, cost):
+                event('improved', iteration=iteration, cost=float(cost))
+            if elite is not None:
+                relinked = None
+                if len(elite):
+                    with phase('relink'):
+                        guide = elite.guide(solution, guides)
+                        if guide is not None:
+                            relinked = path_relinking(rotations, weights,
+                                                      solution, guide)
+                elite.add(solution, cost)
+                if relinked is not None:
+                    with phase('local_search'):
+                        relinked = [int(k) for k in search(rotations, relinked[0])]
+                    relinked_cost = weights[relinked].sum()
+                    instrument.count('relinked')
+                    if incumbent.offer(relinked, relinked_cost):
+                        event('improved', iteration=iteration,
+                              cost=float(relinked_cost), relinked=True)
+                    elite.add(relinked, relinked_cost)
+            if incumbent.done():
+                break
+    return incumbent.solution
 
 def main():
     from optparse import OptionParser
     parser = OptionParser(usage="usage: %prog [options] [input_file]")
     parser.add_option('-a', '--alpha', type='float', default=0.3, metavar='NUM', help='Alpha parameter for RCL construction')
+    parser.add_option('-r', '--reactive', action='store_true', help='Learn the alpha of each iteration among 0.1, 0.2, ..., 0.9')
+    parser.add_option('--block-size', type='int', default=50, metavar='NUM', help='Iterations between updates of the reactive alpha probabilities')
+    parser.add_option('--elite', type='int', default=0, metavar='NUM', help='Relink solutions with an elite pool of this size')
     parser.add_option('-b', '--ptb',   type='float', default=300, metavar='NUM', help='Per task bonification in greedy function')
     parser.add_option('-p', '--pertr', type='float', default=0,   metavar='NUM', help='Cost perturbation radius in greedy function')
+    parser.add_option('-n', '--iterations', type='int', default=100, metavar='NUM', help='Number of GRASP iterations, 0 for no limit')
+    parser.add_option('-t', '--seconds', type='float', metavar='NUM', help='Stop after this many seconds')
+    parser.add_option('--target', type='float', metavar='NUM', help='Stop once a solution costs at most this much')
+    parser.add_option('--convergence', metavar='FILE', help='Write the time, cost and unfitness of each improvement to FILE')
+    parser.add_option('-w', '--workers', type='int', default=1, metavar='NUM', help='Number of worker processes')
+    parser.add_option('-s', '--seed',  type='int',   default=0,   metavar='NUM', help='Random seed')
+    parser.add_option('-c', '--crew-cost', type='float', default=CREW_COST, metavar='NUM', help='Cost of each rotation in a solution, besides its transitions')
+    parser.add_option('-m', '--search', choices=('first', 'best', 'none'), default='first', metavar='MODE', help='Local search mode: first, best or none')
+    parser.add_option('-e', '--evaluations', type='int', metavar='NUM', help='Maximum number of moves evaluated by local search')
+    parser.add_option('--column-generation', action='store_true', help='Search a pool of rotations grown by pricing instead of all of them')
+    parser.add_option('--bound', action='store_true', help='Compute a Lagrangian lower bound and report the optimality gap')
+    parser.add_option('--reduce', action='store_true', help='Also drop the rotations whose reduced cost exceeds the gap')
     parser.add_option('--debug-greedy', action='store_true', help='Print debugging data for construction stage')
     parser.add_option('--debug-search', action='store_true', help='Print debugging data for search stage')
+    parser.add_option('--rebuild-cache', action='store_true', help='Regenerate the cached rotations of the instance')
+    instrument.add_options(parser)
     (options, args) = parser.parse_args()
     if not args:
         args = ['orlib/csp50.txt']
+    if options.reactive and options.workers > 1 and options.block_size < 2 * options.workers:
+        parser.error('--block-size must be at least twice the number of workers')
+    if options.profile and options.workers > 1:
+        parser.error('--profile only covers this process: use it with -w 1')
+    instrument.setup(options)
 
+    global DEBUG_SOLUTION, DEBUG_RCL, DEBUG_MOVE
     if not options.debug_greedy:
-        global DEBUG_SOLUTION, DEBUG_RCL
         DEBUG_SOLUTION = lambda *args: None
         DEBUG_RCL = lambda *args: None
+    if not options.debug_search:
+        DEBUG_MOVE = lambda *args: None
+    instrument.run(options, solve, options, args)
 
-    csp = CrewSchedulingProblem(open(args[0]))
-    rotations = list(csp.generate_rotations())
+def solve(options, args):
+    if options.column_generation:
+        csp, rotations = load_pool(open(args[0]), options.crew_cost)
+        print 'Rotation pool: %d' % len(rotations)
+    else:
+        csp, rotations = load_problem(open(args[0]), options.rebuild_cache)
+    bound = None
+    if options.bound or options.reduce:
+        with phase('bound'):
+            bound = lagrangian_bound(rotations.matrix(),
+                                     rotations.costs + options.crew_cost)
+        print '%s: %.1f, upper bound: %d' % (
+                'Pool lower bound' if options.column_generation else 'Lower bound',
+                bound.lower, bound.upper)
+        if options.reduce:
+            keep = reduce_columns(bound)
+            print 'Rotations kept: %d of %d' % (keep.sum(), len(keep))
+            rotations = rotations.select(keep)
 
-    greedy_cost = partial(rotation_cost, per_task_bonification=options.ptb, perturbation_radius=options.pertr)
-    solution = grasp(rotations, csp, options.alpha, greedy_cost)
+    greedy = GreedyKeys(rotations, options.ptb, options.pertr)
+    reactive = None
+    if options.reactive:
+        reactive = ReactiveAlpha(block_size=options.block_size, seed=options.seed)
+    if options.search == 'none':
+        search = lambda rotations, solution: solution
+    else:
+        search = partial(local_search, crew_cost=options.crew_cost,
+                         mode=options.search, max_evaluations=options.evaluations)
+    incumbent = Incumbent(options.seconds, options.target)
+    if bound is not None and bound.solution is not None:
+        # start from the solution found along with the bound
+        solution = bound.solution
+        if options.reduce:
+            solution = (keep.cumsum() - 1)[solution]
+        incumbent.offer([int(k) for k in solution], bound.upper)
+    solution = grasp(rotations, csp, options.alpha, greedy,
+                     max_iterations=options.iterations or None,
+                     workers=options.workers, seed=options.seed,
+                     search=search, crew_cost=options.crew_cost,
+                     incumbent=incumbent, reactive=reactive,
+                     elite=ElitePool(options.elite) if options.elite else None)
+    if options.convergence:
+        with open(options.convergence, 'w') as f:
+            incumbent.write_trace(f)
+    if solution is None:
+        print 'No solution found'
+        return
+    cost = rotations.costs[solution].sum() + options.crew_cost * len(solution)
+    print 'Best cost: %d, transitions: %d, nr_rotations: %d' % (
+            cost, rotations.costs[solution].sum(), len(solution))
+    if reactive is not None:
+        print 'Alpha probabilities: %s' % ', '.join(
+                '%g: %.3f' % a for a in zip(reactive.alphas,
+                                            reactive.current_probabilities()))
+    if bound is not None:
+        # On a generated pool the bound only holds for the pool.
+        print '%s gap: %.2f%%' % (
+                'Pool optimality' if options.column_generation else 'Optimality',
+                100 * gap(cost, bound.lower))
 
 if __name__ == '__main__':
     main()
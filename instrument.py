@@ -0,0 +1,125 @@
+# Phase timers, counters and traces for solver runs.
+#
+# Instrumentation is off unless setup() turns it on. While off, phase()
+# hands out one shared do-nothing context manager and count() and event()
+# return at once, so instrumented code only pays a function call per phase.
+#
+# When a trace file is given, every phase and event is appended to it as a
+# JSON line. Worker processes forked afterwards write to the same file, and
+# send their totals back with collect() for the parent to merge(), so that
+# report() covers them too. cProfile only sees the process it runs in.
+
+import os
+import sys
+import json
+from collections import defaultdict
+from time import time
+
+enabled = False
+trace_file = None
+seconds = defaultdict(float)
+calls = defaultdict(int)
+counters = defaultdict(int)
+
+class _NullPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        return False
+
+_null_phase = _NullPhase()
+
+class _Phase(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time()
+
+    def __exit__(self, *exc_info):
+        elapsed = time() - self.start
+        seconds[self.name] += elapsed
+        calls[self.name] += 1
+        if trace_file is not None:
+            write(dict(phase=self.name, start=self.start, seconds=elapsed))
+        return False
+
+def phase(name):
+    """Context manager timing a phase of the run."""
+    if not enabled:
+        return _null_phase
+    return _Phase(name)
+
+def count(name, n=1):
+    if enabled:
+        counters[name] += n
+
+def event(name, **data):
+    """Record a one-off event, such as a new best solution."""
+    if enabled:
+        counters[name] += 1
+        if trace_file is not None:
+            data.update(event=name, time=time())
+            write(data)
+
+def reset():
+    """Forget the totals, such as those a forked worker inherits."""
+    seconds.clear()
+    calls.clear()
+    counters.clear()
+
+def collect():
+    """The totals since the last reset, reset: what a worker process sends
+    back to be merged into the parent's. None while disabled."""
+    if not enabled:
+        return None
+    totals = dict(seconds), dict(calls), dict(counters)
+    reset()
+    return totals
+
+def merge(totals):
+    """Add the totals collected in another process to this one's."""
+    if totals is None:
+        return
+    for into, values in zip((seconds, calls, counters), totals):
+        for name, value in values.iteritems():
+            into[name] += value
+
+def write(record):
+    record['pid'] = os.getpid()
+    # one write call per line, so that lines of forked workers don't mix
+    trace_file.write(json.dumps(record, sort_keys=True) + '\n')
+
+def add_options(parser):
+    parser.add_option('--trace', metavar='FILE', help='Append phase timings and events to FILE as JSON lines')
+    parser.add_option('--stats', action='store_true', help='Print phase timings and counters when done')
+    parser.add_option('--profile', metavar='FILE', help='Run under cProfile and dump the stats to FILE')
+
+def setup(options):
+    global enabled, trace_file
+    enabled = bool(options.trace or options.stats)
+    if options.trace:
+        trace_file = open(options.trace, 'a', 0)
+
+def run(options, function, *args, **kwargs):
+    """Call ``function``, under cProfile if a profile file was requested,
+    and report the collected timings afterwards."""
+    try:
+        if not options.profile:
+            return function(*args, **kwargs)
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            profiler.dump_stats(options.profile)
+    finally:
+        if options.stats:
+            report()
+
+def report(stream=sys.stderr):
+    for name in sorted(seconds, key=seconds.get, reverse=True):
+        stream.write('%-16s %10.3fs %10d calls\n' % (name, seconds[name], calls[name]))
+    for name in sorted(counters):
+        stream.write('%-16s %10d\n' % (name, counters[name]))
@@ -0,0 +1,133 @@
+# Elite pool and path relinking for GRASP.
+#
+# The pool keeps the best solutions found so far that differ enough from
+# one another. Path relinking walks from a new solution towards a member of
+# the pool, bringing in one rotation of the guide at a time, and returns the
+# best partition met on the way.
+
+from numpy import zeros, empty
+from sparse import gather, segment_sum
+range = xrange
+
+class ElitePool(object):
+    """Bounded pool of good solutions, distant from each other.
+
+    Solutions are sets of rotations, and their distance is the size of
+    their symmetric difference.
+    """
+    def __init__(self, size=10, min_distance=4):
+        self.size = size
+        self.min_distance = min_distance
+        self.members = []  # (cost, frozenset of rotations)
+
+    def __len__(self):
+        return len(self.members)
+
+    def add(self, solution, cost):
+        """Insert ``solution`` if it earns a place; True if it did."""
+        s = frozenset(solution)
+        if any(s == m for c, m in self.members):
+            return False
+        if len(self.members) < self.size:
+            self.members.append((cost, s))
+            return True
+        costs = [c for c, m in self.members]
+        if cost >= max(costs):
+            return False
+        # Unless it is the best so far, a solution must bring diversity.
+        if cost >= min(costs) and min(len(s ^ m) for c, m in self.members) < self.min_distance:
+            return False
+        # It replaces the most similar of the members costing more.
+        worse = [i for i, (c, m) in enumerate(self.members) if c > cost]
+        i = min(worse, key=lambda i: (len(s ^ self.members[i][1]),
+                                      -self.members[i][0]))
+        self.members[i] = (cost, s)
+        return True
+
+    def guide(self, solution, random):
+        """A member to relink ``solution`` with, picked with ``random``
+        with probability proportional to its distance, or None."""
+        s = frozenset(solution)
+        distances = [len(s ^ m) for c, m in self.members]
+        x = random.random() * sum(distances)
+        for d, (c, m) in zip(distances, self.members):
+            x -= d
+            if x < 0:
+                return sorted(m)
+        return None
+
+def cover_exactly(rotations, weights, tasks):
+    """Rotations partitioning ``tasks``, taken greedily by weight per task,
+    or None if some task can't be covered."""
+    left = zeros(rotations.nr_tasks, dtype=bool)
+    left[tasks] = True
+    rows = rotations.matrix().rows
+    cover = []
+    while left.any():
+        ks = rows[left.argmax()]
+        covered, offsets = gather(rotations.offsets, rotations.tasks, ks)
+        ks = ks[segment_sum(left[covered], offsets) == rotations.sizes[ks]]
+        if not len(ks):
+            return None
+        k = ks[(weights[ks] / rotations.sizes[ks].astype(float)).argmin()]
+        left[rotations.tasks_of(k)] = False
+        cover.append(k)
+    return cover
+
+def path_relinking(rotations, weights, source, guide):
+    """Cheapest partition strictly between ``source`` and ``guide``, and
+    its weight, or None if there is none.
+
+    At each step, every rotation of the guide not in the current solution
+    is tried: it displaces the rotations sharing a task with it, found
+    through the task owner index, and the tasks left uncovered are covered
+    again greedily. The cheapest such move is applied. Rotations of the
+    guide are never displaced, so the walk reaches it after at most
+    ``len(guide)`` steps.
+    """
+    current = set(source)
+    owner = empty(rotations.nr_tasks, dtype='int64')
+    for r in current:
+        owner[rotations.tasks_of(r)] = r
+    weight = weights[list(current)].sum()
+    best, best_weight = None, None
+
+    def move(g):
+        tasks = rotations.tasks_of(g)
+        removed = set(owner[tasks].tolist())
+        left = zeros(rotations.nr_tasks, dtype=bool)
+        for r in removed:
+            left[rotations.tasks_of(r)] = True
+        left[tasks] = False
+        fill = cover_exactly(rotations, weights, left.nonzero()[0])
+        if fill is None:
+            return None
+        delta = (weights[g] + weights[fill].sum() -
+                 weights[list(removed)].sum())
+        return delta, g, removed, fill
+
+    # A move only changes when another one takes some of its tasks.
+    moves = dict((g, move(g)) for g in set(guide) - current)
+    while moves:
+        candidates = [m for m in moves.itervalues() if m is not None]
+        if not candidates:
+            break
+        delta, g, removed, fill = min(candidates)
+        current -= removed
+        touched = zeros(rotations.nr_tasks, dtype=bool)
+        for r in [g] + fill:
+            current.add(r)
+            owner[rotations.tasks_of(r)] = r
+            touched[rotations.tasks_of(r)] = True
+        weight += delta
+        del moves[g]
+        if not moves:
+            break  # reached the guide
+        if best is None or weight < best_weight:
+            best, best_weight = sorted(current), weight
+        for h in moves:
+            if touched[rotations.tasks_of(h)].any():
+                moves[h] = move(h)
+    if best is None:
+        return None
+    return [int(k) for k in best], best_weight
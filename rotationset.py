@@ -0,0 +1,139 @@
+from csp import Rotation, frozenset
+from array import array
+from sparse import BinaryMatrix, segment_sum, gather
+from numpy import frombuffer, zeros, cumsum, diff, arange, asarray
+range = xrange
+
+class RotationSet(object):
+    """Rotations stored column-wise in flat arrays.
+
+    The tasks of rotation k are ``tasks[offsets[k]:offsets[k + 1]]``, sorted.
+    """
+    def __init__(self, nr_tasks, offsets, tasks, costs, durations):
+        self.nr_tasks = nr_tasks
+        self.offsets = offsets
+        self.tasks = tasks
+        self.costs = costs
+        self.durations = durations
+        self.sizes = diff(offsets)
+        self.nr_duplicates = 0
+        self._matrix = None
+        self._by_tasks = None
+
+    @classmethod
+    def generate(cls, csp):
+        """RotationSet of all the rotations of ``csp``.
+
+        Duplicate task sets are only looked for if the instance allows
+        them: when every transition goes to a later task, the tasks of a
+        rotation fix its path, and ``nr_duplicates`` is None.
+        """
+        return cls.from_rotations(csp.generate_rotations(), len(csp.tasks),
+                                  unique=csp.order_violation() is not None)
+
+    @classmethod
+    def from_rotations(cls, rotations, nr_tasks, unique=False):
+        """RotationSet of ``rotations``, keeping only the cheapest rotation
+        over each set of tasks if ``unique``.
+
+        Duplicates are dropped as the rotations stream in: a dict maps the
+        hash of each task tuple to the rotation kept for it, and
+        ``nr_duplicates`` of the result counts the rotations dropped. The
+        dict has one entry per rotation kept, which the result holds anyway:
+        a smaller table would let duplicates through.
+        """
+        # Typed buffers keep enumeration from creating one object per task.
+        sizes, starts, tasks = array('l'), array('l'), array('i')
+        costs, durations = array('l'), array('l')
+        kept = {}
+        collisions = {}  # full tuple keys for the sets whose hash was taken
+        nr_duplicates = 0
+        for r in rotations:
+            key = tuple(sorted(r.tasks))
+            n = len(sizes)
+            if not unique:
+                sizes.append(len(key))
+                tasks.extend(key)
+                costs.append(r.cost)
+                durations.append(r.duration)
+                continue
+            k = kept.setdefault(hash(key), n)
+            if k != n and tuple(tasks[starts[k]:starts[k] + sizes[k]]) != key:
+                k = collisions.setdefault(key, n)
+            if k != n:
+                nr_duplicates += 1
+                if r.cost < costs[k]:
+                    costs[k], durations[k] = r.cost, r.duration
+                continue
+            sizes.append(len(key))
+            starts.append(len(tasks))
+            tasks.extend(key)
+            costs.append(r.cost)
+            durations.append(r.duration)
+        offsets = zeros(len(sizes) + 1, dtype='int64')
+        cumsum(frombuffer(sizes, dtype='int_'), out=offsets[1:])
+        rotation_set = cls(nr_tasks, offsets,
+                           frombuffer(tasks, dtype='intc').copy(),
+                           frombuffer(costs, dtype='int_').copy(),
+                           frombuffer(durations, dtype='int_').copy())
+        rotation_set.nr_duplicates = nr_duplicates if unique else None
+        return rotation_set
+
+    def __len__(self):
+        return len(self.costs)
+
+    def __getitem__(self, k):
+        return Rotation(frozenset(self.tasks_of(k)),
+                        self.costs[k], self.durations[k])
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def __repr__(self):
+        return '<RotationSet, %d rotations over %d tasks>' % (
+                len(self), self.nr_tasks)
+
+    def tasks_of(self, k):
+        return self.tasks[self.offsets[k]:self.offsets[k + 1]]
+
+    def task_mask(self, ks):
+        """Boolean mask of the tasks covered by rotations ``ks``."""
+        mask = zeros(self.nr_tasks, dtype=bool)
+        for k in ks:
+            mask[self.tasks_of(k)] = True
+        return mask
+
+    def hits(self, task_mask):
+        """Number of tasks in ``task_mask`` covered by each rotation."""
+        return segment_sum(task_mask[self.tasks], self.offsets)
+
+    def disjoint_from(self, task_mask):
+        """Boolean mask of the rotations sharing no task with ``task_mask``."""
+        return self.hits(task_mask) == 0
+
+    def select(self, ks):
+        """New RotationSet with only the rotations ``ks``, in that order."""
+        ks = arange(len(self))[ks]
+        tasks, offsets = gather(self.offsets, self.tasks, ks)
+        return RotationSet(self.nr_tasks, offsets, tasks,
+                           self.costs[ks], self.durations[ks])
+
+    def matrix(self):
+        """Task x rotation incidence matrix, built on first use."""
+        if self._matrix is None:
+            self._matrix = BinaryMatrix(self.nr_tasks, self.offsets, self.tasks)
+        return self._matrix
+
+    def find(self, tasks):
+        """Cheapest rotation covering exactly ``tasks`` (sorted), or None."""
+        if self._by_tasks is None:
+            by_tasks = {}
+            costs = self.costs
+            for k in range(len(self)):
+                key = self.tasks_of(k).tostring()
+                if key not in by_tasks or costs[k] < costs[by_tasks[key]]:
+                    by_tasks[key] = k
+            self._by_tasks = by_tasks
+        key = asarray(tasks, dtype=self.tasks.dtype).tostring()
+        return self._by_tasks.get(key)
@@ -0,0 +1,99 @@
+from numpy import zeros, arange, cumsum, diff, add, bincount, asarray
+range = xrange
+
+def segment_sum(values, ptr):
+    """Sums of ``values[ptr[k]:ptr[k + 1]]`` along the first axis.
+
+    Integer and boolean values are summed as int64, others as float64.
+    """
+    values = asarray(values)
+    dtype = 'int64' if values.dtype.kind in 'biu' else 'float64'
+    out = zeros((len(ptr) - 1,) + values.shape[1:], dtype=dtype)
+    nonempty = ptr[:-1] < ptr[1:]
+    if values.size:
+        out[nonempty] = add.reduceat(values, ptr[:-1][nonempty], axis=0,
+                                     dtype=dtype)
+    return out
+
+def gather(ptr, ind, ks):
+    """Concatenation of the segments ``ind[ptr[k]:ptr[k + 1]]`` for ``ks``.
+
+    Returns the gathered entries and the offsets of each segment in them.
+    """
+    return gather_ranges(ind, ptr[:-1][ks], ptr[1:][ks])
+
+def gather_ranges(ind, starts, stops):
+    """Concatenation of the slices ``ind[start:stop]``, and their offsets."""
+    sizes = stops - starts
+    offsets = zeros(len(sizes) + 1, dtype='int64')
+    cumsum(sizes, out=offsets[1:])
+    positions = (arange(offsets[-1]) - offsets[:-1].repeat(sizes) +
+                 starts.repeat(sizes))
+    return ind[positions], offsets
+
+
+class Slices(object):
+    """Read-only sequence view of the segments of a compressed index."""
+    def __init__(self, ptr, ind):
+        self.ptr, self.ind = ptr, ind
+
+    def __len__(self):
+        return len(self.ptr) - 1
+
+    def __getitem__(self, k):
+        return self.ind[self.ptr[k]:self.ptr[k + 1]]
+
+
+class BinaryMatrix(object):
+    """0/1 matrix stored both by column (CSC) and by row (CSR)."""
+    def __init__(self, nr_rows, col_ptr, row_ind):
+        nr_cols = len(col_ptr) - 1
+        self.shape = (nr_rows, nr_cols)
+        self.col_ptr, self.row_ind = col_ptr, row_ind
+
+        cols = arange(nr_cols, dtype=row_ind.dtype).repeat(diff(col_ptr))
+        self.col_ind = cols[row_ind.argsort(kind='mergesort')]
+        self.row_ptr = zeros(nr_rows + 1, dtype='int64')
+        cumsum(bincount(row_ind, minlength=nr_rows), out=self.row_ptr[1:])
+
+        self.rows = Slices(self.row_ptr, self.col_ind)
+        self.columns = Slices(self.col_ptr, self.row_ind)
+
+    def __repr__(self):
+        return '<BinaryMatrix %dx%d, %d nonzeros>' % (
+                self.shape + (len(self.row_ind),))
+
+    def dot(self, x):
+        """A x, where x is a vector or has one column per solution."""
+        return segment_sum(asarray(x)[self.col_ind], self.row_ptr)
+
+    def cover(self, cols):
+        """A x for the 0/1 vector x whose nonzero entries are ``cols``."""
+        rows, _ = gather(self.col_ptr, self.row_ind, cols)
+        return bincount(rows, minlength=self.shape[0])
+
+    def hits(self, row_mask, cols=None):
+        """Number of rows in ``row_mask`` covered by each of ``cols``."""
+        if cols is None:
+            return segment_sum(asarray(row_mask)[self.row_ind], self.col_ptr)
+        rows, offsets = gather(self.col_ptr, self.row_ind, cols)
+        return segment_sum(asarray(row_mask)[rows], offsets)
+
+    def cover_all(self, X, cols=None):
+        """A X for a 0/1 matrix X with few nonzeros, one column per solution.
+
+        If ``cols`` is given, X only has the rows for those columns of A.
+        """
+        js, ks = X.nonzero()
+        if cols is not None:
+            js = asarray(cols)[js]
+        return self.cover_pairs(js, ks, X.shape[1])
+
+    def cover_pairs(self, js, ks, nr_solutions):
+        """A X for the 0/1 matrix X whose nonzeros are at ``(js, ks)``."""
+        nr_rows = self.shape[0]
+        rows, offsets = gather(self.col_ptr, self.row_ind, js)
+        ks = asarray(ks).repeat(diff(offsets))
+        return bincount(rows.astype('int64') * nr_solutions + ks,
+                        minlength=nr_rows * nr_solutions
+                        ).reshape(nr_rows, nr_solutions)